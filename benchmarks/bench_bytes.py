@@ -0,0 +1,42 @@
+"""
+Cost of producing encoded output: render().encode() compared with
+render_bytes(), which encodes each run of values and short static text with
+one call and long static text when the template is compiled.
+
+    python -m benchmarks.bench_bytes [rows]
+
+`join` also concatenates the pieces returned by render_bytes(), for
+callers that need one bytes object instead of a list of buffers.
+"""
+import sys
+import timeit
+
+from jingu.template import Template
+
+ROW = "<tr class='row'><td>Ünïcode static text of the row</td><td>{{ name }}</td><td>{{ n }}</td></tr>\n"
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    tmpl = Template("<table>\n" + ROW * rows + "</table>")
+    context = {"name": "Jöhn", "n": 42}
+    modes = [
+        ("render().encode()", lambda: tmpl.render(context).encode("utf-8")),
+        ("render_bytes()", lambda: tmpl.render_bytes(context)),
+        ("join", lambda: b"".join(tmpl.render_bytes(context))),
+    ]
+
+    # the modes take turns so that a noisy moment doesn't favour one of them
+    number = 50
+    best = {label: float("inf") for label, _ in modes}
+    for _ in range(20):
+        for label, func in modes:
+            best[label] = min(best[label], timeit.timeit(func, number=number))
+
+    print(f"{'mode':<20} {'us/render':>10}")
+    for label, _ in modes:
+        print(f"{label:<20} {best[label] / number * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Templates that reference the same variables many times.
+
+    python -m benchmarks.bench_context
+
+"exec globals" reproduces the previous strategy: exec the compiled module
+with the context as globals on every render, so each reference is a global
+dict lookup. "fast locals" is Template.render().
+"""
+import timeit
+
+from jingu.template import Template
+
+
+def exec_globals_render(code, **kwargs):
+    locals_ = {}
+    exec(code, kwargs, locals_)
+    return ''.join(locals_['output']())
+
+
+def main():
+    print(f"{'references':>10} {'exec globals':>14} {'fast locals':>12}  usec/render")
+    for refs in (1, 10, 100, 1000):
+        source = "<td>{{ user }}</td><td>{{ n * 2 }}</td>" * refs
+        ctx = {"user": "John Doe", "n": 21}
+
+        tmpl = Template(source)
+        legacy = compile(
+            "def output():\n    yield '<td>'\n"
+            + "    yield str(user)\n    yield '</td><td>'\n    yield str(n * 2)\n    yield '</td><td>'\n" * refs,
+            "<template>", "exec",
+        )
+
+        number = max(1, 20000 // refs)
+        old = min(timeit.repeat(lambda: exec_globals_render(legacy, **ctx), number=number, repeat=5))
+        new = min(timeit.repeat(lambda: tmpl.render(**ctx), number=number, repeat=5))
+        print(f"{refs:>10} {old / number * 1e6:>14.1f} {new / number * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Autoescape overhead per expression.
+
+    python -m benchmarks.bench_escape [expressions per template]
+
+Renders a template made of one kind of expression with autoescape off and
+on and prints the nanoseconds spent per expression. `arithmetic` reads a
+context value, so it is escaped like any other value; only arithmetic on
+constants and loop counters is proven safe.
+"""
+import sys
+import timeit
+
+from jingu.runtime import Markup
+from jingu.template import Template
+
+CASES = [
+    ("plain str", "{{ value }}", "no special characters here"),
+    ("str to escape", "{{ value }}", "<a href='x'>Tom & Jerry</a>"),
+    ("Markup", "{{ value }}", Markup("<b>already safe</b>")),
+    ("int", "{{ value }}", 12345),
+    ("arithmetic", "{{ value - 1 }}", 12345),
+]
+
+
+def per_expression(source, value, n, autoescape):
+    tmpl = Template(source * n, autoescape=autoescape)
+    tmpl.render(value=value)
+    number = 20
+    best = min(timeit.repeat(lambda: tmpl.render(value=value), number=number, repeat=5))
+    return best / number / n * 1e9
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"{'expression':<16} {'plain ns':>9} {'escaped ns':>11} {'overhead ns':>12}")
+    for label, source, value in CASES:
+        plain = per_expression(source, value, n, False)
+        escaped = per_expression(source, value, n, True)
+        print(f"{label:<16} {plain:>9.1f} {escaped:>11.1f} {escaped - plain:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
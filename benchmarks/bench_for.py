@@ -0,0 +1,44 @@
+"""
+Rendering a 100k-row table with {% for %}.
+
+    python -m benchmarks.bench_for
+"""
+import time
+
+from jingu.template import Template
+
+SOURCE = """<table>
+{% for row in rows %}<tr><td>{{ row.id }}</td><td>{{ row.name }}</td><td>{{ row.price * 2 }}</td></tr>
+{% endfor %}</table>"""
+
+SOURCE_LOOP = """<table>
+{% for row in rows %}<tr class="{% if loop.first %}first{% endif %}{% if loop.last %}last{% endif %}"><td>{{ loop.index }}</td><td>{{ row.name }}</td></tr>
+{% endfor %}</table>"""
+
+
+def rows(n):
+    for i in range(n):
+        yield {"id": i, "name": f"item {i}", "price": i % 100}
+
+
+def bench(source, n, repeat=3):
+    tmpl = Template(source)
+    tmpl.code
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(tmpl.render(rows=rows(n)))
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    n = 100000
+    print(f"{'template':<14} {'rows':>8} {'seconds':>8} {'rows/s':>10} {'output MB':>10}")
+    for name, source in (("plain", SOURCE), ("loop helper", SOURCE_LOOP)):
+        elapsed, size = bench(source, n)
+        print(f"{name:<14} {n:>8} {elapsed:>8.3f} {n / elapsed:>10.0f} {size / 1024 / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Lexer throughput on large, markup-light templates.
+
+    python -m benchmarks.bench_lexer
+
+The time per MB should stay flat as the template grows.
+"""
+import time
+
+from jingu.lexer import Lexer
+
+ROW = "<tr><td class=\"cell\">static text that is mostly markup</td><td>{{ row.name }}</td></tr>\n"
+
+
+def make_template(size):
+    rows = size // len(ROW) + 1
+    return (ROW * rows)[:size].rsplit("\n", 1)[0]
+
+
+def bench(source, repeat=3):
+    lexer = Lexer()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lexer.tokenize(source)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'size':>8} {'seconds':>10} {'s/MB':>10}")
+    for mb in (1, 2, 4, 8):
+        source = make_template(mb * 1024 * 1024)
+        elapsed = bench(source)
+        print(f"{mb:>6}MB {elapsed:>10.4f} {elapsed / mb:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Cost of `{{ a.b.c }}` lookups over dicts, dataclasses, __slots__ objects
+and other mappings.
+
+    python -m benchmarks.bench_lookup [lookups per template]
+
+Renders a template made of chained lookups and reports the nanoseconds
+per `.` lookup, including the template's own overhead. `uncached` renders
+the same template with the per-site getters replaced by a getattr-then-
+getitem function, `python` is the plain Python expression.
+"""
+from collections import UserDict
+from dataclasses import dataclass
+import sys
+import timeit
+from unittest import mock
+
+from jingu import runtime
+from jingu.template import Template
+
+
+@dataclass
+class DataInner(object):
+    c: str
+
+
+@dataclass
+class DataOuter(object):
+    b: DataInner
+
+
+class SlotsInner(object):
+    __slots__ = ("c",)
+
+    def __init__(self, c):
+        self.c = c
+
+
+class SlotsOuter(object):
+    __slots__ = ("b",)
+
+    def __init__(self, b):
+        self.b = b
+
+
+SHAPES = [
+    ("dict", {"b": {"c": "x"}}, "a['b']['c']"),
+    ("dataclass", DataOuter(DataInner("x")), "a.b.c"),
+    ("__slots__", SlotsOuter(SlotsInner("x")), "a.b.c"),
+    ("UserDict", UserDict(b=UserDict(c="x")), "a['b']['c']"),
+]
+
+
+def uncached_getter(key, attribute=False):
+    def get(obj):
+        try:
+            return getattr(obj, key)
+        except AttributeError:
+            return obj[key]
+    # never matches, every lookup calls get()
+    get.type = None
+    return get
+
+
+def per_lookup(func, number, lookups):
+    return func(number) / number / lookups * 1e9
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"{'shape':<10} {'cached ns':>10} {'uncached ns':>12} {'python ns':>10}")
+    for label, value, expression in SHAPES:
+        cached = Template("{{ a.b.c }}" * n)
+        with mock.patch.object(runtime, "getter", uncached_getter):
+            uncached = Template("{{ a.b.c }}" * n)
+            uncached.render(a=value)
+        cached.render(a=value)
+        modes = {
+            "cached": (lambda number: timeit.timeit(lambda: cached.render(a=value), number=number), 50, n * 2),
+            "uncached": (lambda number: timeit.timeit(lambda: uncached.render(a=value), number=number), 50, n * 2),
+            "python": (lambda number: timeit.timeit(expression, globals={"a": value}, number=number), 100000, 2),
+        }
+
+        # the modes take turns so that a noisy moment doesn't favour one of them
+        best = dict.fromkeys(modes, float("inf"))
+        for _ in range(10):
+            for mode, (func, number, lookups) in modes.items():
+                best[mode] = min(best[mode], per_lookup(func, number, lookups))
+        print(f"{label:<10} {best['cached']:>10.1f} {best['uncached']:>12.1f} {best['python']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
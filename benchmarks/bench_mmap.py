@@ -0,0 +1,90 @@
+"""
+Memory used to load a large template with get_template(), reading the file
+into a str compared with Environment(mmap_threshold=...).
+
+    python -m benchmarks.bench_mmap [template MB]
+
+Every mode runs in a fresh interpreter and loads and renders the template
+once. `peak heap` and `heap` are the Python allocations traced by
+tracemalloc during and after that, `anon` is the process' anonymous
+resident memory (RssAnon, Linux only) afterwards; pages of a mapped file
+are not part of it since the kernel can drop them at any time. The
+template is mostly static, like a generated report skeleton.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from jingu.template import Environment
+
+MODES = ("read", "mmap")
+ROW = "<tr><td class='label'>static text of the report skeleton</td><td class='value'>{:08d}</td></tr>\n"
+
+
+def write_template(path, megabytes):
+    rows = megabytes * 1024 * 1024 // len(ROW.format(0))
+    with open(path, "w") as f:
+        for i in range(0, rows, 1000):
+            f.write("".join(ROW.format(n) for n in range(i, i + 1000)))
+            f.write("<p>{{ section }} {{ page.number }}</p>\n")
+
+
+def rss_anon_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def run(mode, path):
+    env = Environment(mmap_threshold=1 if mode == "mmap" else None)
+    before = rss_anon_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tmpl = env.get_template(path)
+    assert tmpl.render(section="s", page={"number": 1})
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "peak_mb": peak / 1024 / 1024,
+        "heap_mb": current / 1024 / 1024,
+        "anon_mb": rss_anon_mb() - before,
+    }
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print(f"{'mode':<6} {'template MB':>12} {'peak heap MB':>13} {'heap MB':>9} {'anon MB':>9} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "report.html")
+        write_template(path, megabytes)
+        size = os.path.getsize(path) / 1024 / 1024
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_mmap", "--child", mode, path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            r = json.loads(out)
+            print(
+                f"{r['mode']:<6} {size:>12.1f} {r['peak_mb']:>13.1f} {r['heap_mb']:>9.1f}"
+                f" {r['anon_mb']:>9.1f} {r['seconds']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(run(sys.argv[2], sys.argv[3])))
+    else:
+        main()
@@ -0,0 +1,34 @@
+"""
+Render time and pieces per render with and without the optimizer.
+
+    python -m benchmarks.bench_optimizer
+"""
+import timeit
+
+from jingu.template import Template
+
+SOURCE = """<tr>
+  <td>{{ 60 * 60 * 24 }}</td>
+  <td>{{ name }}</td>
+  <td>{{ 1024 * 1024 }}</td>
+  <td>{{ 100 / 3 }}</td>
+  <td>{{ price * 2 }}</td>
+  {% if True %}<td>always</td>{% endif %}
+</tr>
+""" * 50
+
+
+def main():
+    ctx = {"name": "John Doe", "price": 3}
+    print(f"{'optimized':>10} {'pieces':>8} {'usec/render':>12}")
+    for optimized in (False, True):
+        tmpl = Template(SOURCE)
+        tmpl.optimized = optimized
+        pieces = sum(1 for _ in tmpl.generate(**ctx))
+        number = 2000
+        elapsed = min(timeit.repeat(lambda: tmpl.render(**ctx), number=number, repeat=5))
+        print(f"{str(optimized):>10} {pieces:>8} {elapsed / number * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Renders/second of render() in a loop compared with render_many().
+
+    python -m benchmarks.bench_render_many [contexts] [workers ...]
+
+Every mode renders the same notification template against the same list of
+contexts. The worker counts default to 2 and the number of CPUs.
+"""
+import os
+import sys
+import time
+
+from jingu.template import Template
+
+SOURCE = (
+    "<p>Hi {{ user.name }},</p>\n"
+    "<p>You have {{ count }} new notifications:</p>\n<ul>\n"
+    "{% for item in items %}<li>{{ item.title }} ({{ item.age }} min)</li>\n{% endfor %}"
+    "</ul>\n{% if user.premium %}<p>Thanks for being a premium member.</p>{% endif %}\n"
+)
+
+
+def make_contexts(n):
+    return [
+        {
+            "user": {"name": f"user{i}", "premium": i % 2 == 0},
+            "count": i % 5,
+            "items": [{"title": f"message {j}", "age": j * 7} for j in range(i % 5)],
+        }
+        for i in range(n)
+    ]
+
+
+def run(mode, tmpl, contexts, workers=None):
+    start = time.perf_counter()
+    if mode == "render":
+        for context in contexts:
+            tmpl.render(context)
+    else:
+        for _ in tmpl.render_many(contexts, workers=workers, chunksize=256):
+            pass
+    return len(contexts) / (time.perf_counter() - start)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    worker_counts = [int(w) for w in sys.argv[2:]] or sorted({2, os.cpu_count() or 1})
+    tmpl = Template(SOURCE)
+    tmpl.render_func
+    contexts = make_contexts(n)
+
+    base = run("render", tmpl, contexts)
+    print(f"{'mode':<24} {'renders/s':>12} {'speedup':>8}")
+    print(f"{'render() loop':<24} {base:>12,.0f} {1:>8.2f}")
+    for workers in [1] + [w for w in worker_counts if w > 1]:
+        rate = run("render_many", tmpl, contexts, workers)
+        print(f"{f'render_many(workers={workers})':<24} {rate:>12,.0f} {rate / base:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
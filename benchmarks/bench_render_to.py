@@ -0,0 +1,75 @@
+"""
+Peak RSS and write() calls of render() + write() compared with render_to().
+
+    python -m benchmarks.bench_render_to [output MB]
+
+Every mode runs in a fresh interpreter so that ru_maxrss is not shared.
+The output file is opened unbuffered, so one write() call is one syscall.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from jingu.template import Template
+
+MODES = ("render", "render_to_unbatched", "render_to")
+VALUE = ("x" * 1023 + "\n") * 16
+
+
+class CountingFile(object):
+    def __init__(self, fp):
+        self.fp = fp
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return self.fp.write(data)
+
+
+def run(mode, megabytes, path):
+    tmpl = Template("<td>{{ value }}</td>" * (megabytes * 64))
+    tmpl.code
+
+    start = time.perf_counter()
+    with open(path, "wb", buffering=0) as raw:
+        fp = CountingFile(raw)
+        if mode == "render":
+            fp.write(tmpl.render(value=VALUE).encode("utf-8"))
+        elif mode == "render_to_unbatched":
+            tmpl.stream(value=VALUE).dump(fp, encoding="utf-8", buffer_size=1)
+        else:
+            tmpl.render_to(fp, value=VALUE)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "writes": fp.writes,
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_mb": os.path.getsize(path) / 1024 / 1024,
+    }
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'mode':<22} {'output MB':>10} {'writes':>10} {'peak RSS MB':>12} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "out.html")
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_render_to", "--child", mode, str(megabytes), path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            r = json.loads(out)
+            print(f"{r['mode']:<22} {r['output_mb']:>10.1f} {r['writes']:>10} {r['maxrss_mb']:>12.1f} {r['seconds']:>8.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(run(sys.argv[2], int(sys.argv[3]), sys.argv[4])))
+    else:
+        main()
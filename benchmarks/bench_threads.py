@@ -0,0 +1,63 @@
+"""
+Throughput of one Template shared by many threads, as in a threaded WSGI
+server.
+
+    python -m benchmarks.bench_threads [renders per thread]
+
+Every thread renders the same template object with its own context and
+checks the output. Rendering takes no lock, so with the GIL the total
+throughput should stay close to the single-thread one.
+"""
+import sys
+import threading
+import time
+
+from jingu.template import Template
+
+SOURCE = (
+    "<h1>{{ title }}</h1><ul>"
+    "{% for item in items %}<li class='{{ item.kind }}'>{{ loop.index }} {{ item.name }}</li>{% endfor %}"
+    "</ul>"
+)
+THREAD_COUNTS = (1, 2, 8, 32)
+
+
+def context(i):
+    return {"title": f"page {i}", "items": [{"kind": "row", "name": f"item {n}"} for n in range(20)]}
+
+
+def run(tmpl, threads, renders):
+    barrier = threading.Barrier(threads + 1)
+    failures = []
+
+    def target(i):
+        ctx = context(i)
+        expected = tmpl.render(ctx)
+        barrier.wait()
+        for _ in range(renders):
+            if tmpl.render(ctx) != expected:
+                failures.append(i)
+
+    workers = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if failures:
+        raise AssertionError(f"wrong output in {len(failures)} renders")
+    return threads * renders / elapsed
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    tmpl = Template(SOURCE)
+    print(f"{'threads':>7} {'renders/s':>10}")
+    for threads in THREAD_COUNTS:
+        print(f"{threads:>7} {run(tmpl, threads, renders):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Memory used by the token stream of a large template, measured with tracemalloc.
+
+    python -m benchmarks.bench_tokens [MB]
+
+"Token objects" is the former representation: one object with a __dict__
+and a copied value string per token. "slotted Tokens" is a list of the
+current Token class, "TokenStream" is what Lexer.tokenize() returns.
+"""
+import sys
+import tracemalloc
+
+from jingu.lexer import Lexer
+from jingu.template import Template
+
+ROW = "<tr><td>{{ row.id }}</td><td>{{ row['name'] }}</td><td>{{ price * 2 }}</td></tr>\n"
+
+
+class DictToken(object):
+    def __init__(self, type, value):
+        self.type = type
+        self.value = value
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, used
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    source = ROW * (megabytes * 1024 * 1024 // len(ROW))
+    stream = Lexer().tokenize(source)
+
+    cases = [
+        ("Token objects", lambda: [DictToken(t.type, str(t.value)) for t in stream]),
+        ("slotted Tokens", lambda: list(stream)),
+        ("TokenStream", lambda: Lexer().tokenize(source)),
+    ]
+    print(f"source: {len(source) / 1024 / 1024:.1f}MB, {len(stream)} tokens")
+    print(f"{'representation':<16} {'MB':>8} {'bytes/token':>12} {'x source':>9}")
+    for name, build in cases:
+        _, used = measure(build)
+        print(f"{name:<16} {used / 1024 / 1024:>8.1f} {used / len(stream):>12.1f} {used / len(source):>9.2f}")
+
+    tmpl = Template(source)
+    tracemalloc.start()
+    tmpl.parse(Lexer().tokenize(source))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"peak while tokenizing and parsing: {peak / 1024 / 1024:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
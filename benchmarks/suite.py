@@ -0,0 +1,170 @@
+"""
+Per-phase benchmark suite.
+
+Every case is a template built by repeating a unit up to a target size,
+rendered with one context shape. Each phase is timed separately:
+
+- tokenize: Template.tokenize()
+- parse:    Template.parse()
+- codegen:  optimizer and Node.visit(), Template.codegen()
+- compile:  the builtin compile() of the generated source
+- render:   Template.render() with the compiled template
+
+Results are written as JSON and can be compared against a saved baseline.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from jingu.template import Template
+
+SIZES = {
+    "small": 100,
+    "medium": 10 * 1024,
+    "large": 1024 * 1024,
+    "xlarge": 4 * 1024 * 1024,
+}
+
+SHAPES = {
+    "scalars": (
+        "<p class=\"greeting\">Hello {{ name }}, you have {{ count }} new messages.</p>\n",
+        lambda: {"name": "John Doe", "count": 42},
+    ),
+    "nested": (
+        "<div><a href=\"{{ user.url }}\">{{ user['name'] }}</a> {{ order.total * 2 }}</div>\n",
+        lambda: {"user": {"url": "/u/1", "name": "John Doe"}, "order": {"total": 10}},
+    ),
+    "loop": (
+        "<ul>{% for item in items %}<li>{{ loop.index }} {{ item }}</li>{% endfor %}</ul>\n",
+        lambda: {"items": [f"item {i}" for i in range(20)]},
+    ),
+}
+
+PHASES = ("tokenize", "parse", "codegen", "compile", "render")
+
+
+def make_source(unit, size):
+    return unit * max(1, size // len(unit))
+
+
+def best_time(func, min_time=0.2, repeat=3):
+    """best seconds per call, calling func enough times to run min_time"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def run_case(size_name, shape_name, min_time):
+    unit, make_context = SHAPES[shape_name]
+    source = make_source(unit, SIZES[size_name])
+    context = make_context()
+    tmpl = Template(source)
+
+    tokens = tmpl.tokenize(source)
+    code = tmpl.codegen(tmpl.parse(tokens))
+    tmpl.render(context)
+
+    funcs = {
+        "tokenize": lambda: tmpl.tokenize(source),
+        "parse": lambda: tmpl.parse(tokens),
+        # the optimizer rewrites node bodies in place, so codegen needs fresh
+        # nodes; the parse time is subtracted below
+        "codegen": lambda: tmpl.codegen(tmpl.parse(tokens)),
+        "compile": lambda: compile(code, "<template>", "exec"),
+        "render": lambda: tmpl.render(context),
+    }
+    results = {phase: best_time(funcs[phase], min_time) for phase in PHASES}
+    results["codegen"] = max(0.0, results["codegen"] - results["parse"])
+    return {"source_bytes": len(source), "seconds": results}
+
+
+def run(sizes, shapes, min_time, log=print):
+    results = {}
+    for size_name in sizes:
+        for shape_name in shapes:
+            case = f"{size_name}/{shape_name}"
+            results[case] = run_case(size_name, shape_name, min_time)
+            log(format_case(case, results[case]))
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "results": results,
+    }
+
+
+def format_case(case, result):
+    seconds = result["seconds"]
+    return f"{case:<18} " + " ".join(f"{seconds[p] * 1e3:>11.3f}" for p in PHASES)
+
+
+def compare(current, baseline, tolerance):
+    """return (case, phase, baseline, current) for every phase slower than baseline * (1 + tolerance)"""
+    regressions = []
+    for case, result in current["results"].items():
+        base = baseline["results"].get(case)
+        if base is None:
+            continue
+        for phase in PHASES:
+            old = base["seconds"].get(phase)
+            new = result["seconds"][phase]
+            if old and new > old * (1 + tolerance):
+                regressions.append((case, phase, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(SIZES), help="comma separated, from: " + ", ".join(SIZES))
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="comma separated, from: " + ", ".join(SHAPES))
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per measurement")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    sizes = [s for s in args.sizes.split(",") if s]
+    shapes = [s for s in args.shapes.split(",") if s]
+    for name in sizes:
+        if name not in SIZES:
+            parser.error(f"unknown size: {name}")
+    for name in shapes:
+        if name not in SHAPES:
+            parser.error(f"unknown shape: {name}")
+
+    print(f"{'case':<18} " + " ".join(f"{p + ' ms':>11}" for p in PHASES))
+    current = run(sizes, shapes, args.min_time)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        for case, phase, old, new in regressions:
+            print(f"REGRESSION {case} {phase}: {old * 1e3:.3f}ms -> {new * 1e3:.3f}ms ({new / old - 1:+.0%})")
+        if regressions:
+            return 1
+        print(f"no regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
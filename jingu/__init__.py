@@ -1,4 +1,12 @@
 # flake8: noqa
 
 from .template import Environment
+from .template import TemplateEvent
 from .template import Template
+from .template import TemplateStream
+from .bccache import FileSystemBytecodeCache
+from .fragcache import FileSystemFragmentCache
+from .fragcache import MemoryFragmentCache
+from .runtime import Lazy
+from .runtime import Markup
+from .runtime import escape
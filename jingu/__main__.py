@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+
+from .template import Environment
+
+
+def find_templates(templates_dir):
+    """paths of the files below templates_dir, skipping hidden files and directories"""
+    for root, dirs, files in os.walk(templates_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for filename in sorted(files):
+            if not filename.startswith("."):
+                yield os.path.join(root, filename)
+
+
+def compile_command(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    env = Environment(cache_size=0, autoescape=args.autoescape, trim_blocks=args.trim_blocks,
+                      lstrip_blocks=args.lstrip_blocks, minify=args.minify, templates_dir=args.templates_dir)
+
+    report = env.compile_templates(find_templates(args.templates_dir), workers=args.workers, out_dir=args.out_dir)
+    for path, error in sorted(report.errors.items()):
+        print(f"error: {path}: {error}", file=sys.stderr)
+    print(f"compiled {len(report.compiled)} templates into {args.out_dir} "
+          f"in {report.seconds:.2f}s ({report.throughput:.0f} templates/s)")
+    return 1 if report.errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m jingu")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="precompile templates into importable python modules")
+    compile_parser.add_argument("templates_dir")
+    compile_parser.add_argument("-o", "--out-dir", required=True)
+    compile_parser.add_argument("-j", "--workers", type=int, default=None,
+                                help="number of worker processes, default: one per CPU")
+    compile_parser.add_argument("--autoescape", action="store_true", help="HTML-escape expressions")
+    compile_parser.add_argument("--trim-blocks", action="store_true", help="drop the first newline after block tags")
+    compile_parser.add_argument("--lstrip-blocks", action="store_true", help="strip indentation before block tags")
+    compile_parser.add_argument("--minify", action="store_true", help="collapse whitespace in static text")
+    compile_parser.set_defaults(func=compile_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+from importlib.util import MAGIC_NUMBER
+import fnmatch
+import hashlib
+import marshal
+import os
+import tempfile
+
+# bump whenever the generated code changes in an incompatible way
+bc_version = 1
+bc_magic = b"jingu" + bc_version.to_bytes(2, "big") + MAGIC_NUMBER
+
+
+class FileSystemBytecodeCache(object):
+    """
+    Stores compiled template code objects in a directory.
+
+    Entries are keyed by a hash of the template source, the environment
+    options affecting the generated code, the cache format version and the
+    Python bytecode magic, and are written atomically so that many
+    processes can share the same directory.
+    """
+
+    def __init__(self, directory, pattern="__jingu_%s.cache"):
+        self.directory = directory
+        self.pattern = pattern
+        os.makedirs(directory, exist_ok=True)
+
+    def get_cache_key(self, source, options=None):
+        h = hashlib.sha1(bc_magic)
+        if options:
+            h.update(repr(sorted(options.items())).encode("utf-8"))
+        # bytes-like sources, e.g. mapped template files, are utf-8 already
+        h.update(source.encode("utf-8") if isinstance(source, str) else source)
+        return h.hexdigest()
+
+    def _get_cache_filename(self, key):
+        return os.path.join(self.directory, self.pattern % key)
+
+    def load(self, source, options=None):
+        filename = self._get_cache_filename(self.get_cache_key(source, options))
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if not data.startswith(bc_magic):
+            return None
+        try:
+            code = marshal.loads(data[len(bc_magic):])
+        except (EOFError, ValueError, TypeError):
+            return None
+        if not hasattr(code, "co_code"):
+            return None
+        return code
+
+    def dump(self, source, code, options=None):
+        filename = self._get_cache_filename(self.get_cache_key(source, options))
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".tmp", dir=self.directory)
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(bc_magic)
+                marshal.dump(code, f)
+            os.replace(tmp, filename)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def clear(self):
+        for filename in fnmatch.filter(os.listdir(self.directory), self.pattern % "*"):
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
@@ -0,0 +1,198 @@
+from collections import OrderedDict, namedtuple
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+
+FragmentCacheInfo = namedtuple("FragmentCacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+
+class FragmentCache(object):
+    """
+    Base class of the stores used by {% cache %}.
+
+    Subclasses implement load(key), returning the cached str or None when
+    it is missing or expired, and store(key, value, expires), where
+    `expires` is a time.time() timestamp or None. get() and set() keep the
+    hit/miss counters. cleanup() removes the expired fragments.
+    """
+
+    maxsize = None
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # guards the counters, subclasses may use it for their data too
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.store(key, value, None if ttl is None else time.time() + ttl)
+
+    def load(self, key):
+        raise NotImplementedError()
+
+    def store(self, key, value, expires):
+        raise NotImplementedError()
+
+    def cleanup(self):
+        """remove the expired fragments, return how many were removed"""
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def cache_info(self):
+        return FragmentCacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self))
+
+
+class MemoryFragmentCache(FragmentCache):
+    """fragments kept in this process, the least recently used are dropped beyond `maxsize`"""
+
+    def __init__(self, maxsize=1024):
+        super().__init__()
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def load(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def store(self, key, value, expires):
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires) in self._data.items() if expires and expires <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileSystemFragmentCache(FragmentCache):
+    """
+    Fragments stored as files in a directory, one per key, so that several
+    processes can share them. Files are replaced atomically; the expiry
+    time is stored in front of the utf-8 encoded fragment. load() deletes
+    the expired file it finds, cleanup() all of them, e.g. from a periodic
+    job, since fragments whose key is never used again are never loaded.
+    """
+
+    _header = struct.Struct(">d")
+
+    def __init__(self, directory, pattern="__jingu_fragment_%s"):
+        super().__init__()
+        self.directory = directory
+        self.pattern = pattern
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_filename(self, key):
+        return os.path.join(self.directory, self.pattern % hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def load(self, key):
+        filename = self._get_filename(key)
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(data) < self._header.size:
+            return None
+        (expires,) = self._header.unpack_from(data)
+        if expires and expires <= time.time():
+            # another process may have stored a fresh fragment in between,
+            # removing it only costs a miss
+            self._remove(filename)
+            return None
+        try:
+            return data[self._header.size:].decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+    def store(self, key, value, expires):
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".tmp", dir=self.directory)
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._header.pack(expires or 0))
+                f.write(value.encode("utf-8"))
+            os.replace(tmp, self._get_filename(key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _filenames(self):
+        prefix = self.pattern % ""
+        return [f for f in os.listdir(self.directory) if f.startswith(prefix)]
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def cleanup(self):
+        now = time.time()
+        removed = 0
+        for filename in self._filenames():
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, "rb") as f:
+                    header = f.read(self._header.size)
+            except OSError:
+                continue
+            if len(header) < self._header.size:
+                continue
+            (expires,) = self._header.unpack(header)
+            if expires and expires <= now:
+                self._remove(path)
+                removed += 1
+        return removed
+
+    def clear(self):
+        for filename in self._filenames():
+            self._remove(os.path.join(self.directory, filename))
+
+    def __len__(self):
+        return len(self._filenames())
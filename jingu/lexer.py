@@ -1,4 +1,6 @@
+from array import array
 from enum import Enum, auto
+import re
 
 
 class TokenType(Enum):
@@ -21,6 +23,8 @@ class TokenType(Enum):
 
 
 class Token(object):
+    __slots__ = ("type", "value")
+
     def __init__(self, type, value):
         if not isinstance(type, TokenType):
             raise TypeError("type must be specified TokenType object")
@@ -34,5 +38,255 @@ class Token(object):
         return f"Token({self.type.name}, '{self.value}')"
 
 
+class TokenStream(object):
+    """
+    Compact sequence of tokens.
+
+    Tokens are kept as parallel arrays of types and (start, end) offsets into
+    the source, token values are sliced from the source only when accessed.
+    Indexing returns a Token, so the stream can be used like a list of tokens.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        offset_type = "I" if len(source) < 2 ** 32 else "Q"
+        # TokenType members are shared, so this costs one pointer per token
+        self.types = []
+        self.starts = array(offset_type)
+        self.ends = array(offset_type)
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """build a stream from a list of Token objects"""
+        values = [t.value for t in tokens]
+        stream = cls("".join(values))
+        pos = 0
+        for t, value in zip(tokens, values):
+            stream.append(t.type, pos, pos + len(value))
+            pos += len(value)
+        return stream
+
+    def append(self, type, start, end):
+        self.types.append(type)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def type(self, i):
+        return self.types[i]
+
+    def value(self, i):
+        return self.source[self.starts[i]:self.ends[i]]
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return Token(self.types[i], self.source[self.starts[i]:self.ends[i]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"TokenStream({list(self)!r})"
+
+
+class EncodedTokenStream(TokenStream):
+    """
+    Tokens of an encoded source, e.g. bytes or a mmap of the template file.
+    Offsets count bytes and values are decoded when accessed, so no str
+    copy of the whole source is ever made.
+    """
+
+    def __init__(self, source, encoding="utf-8"):
+        super().__init__(source)
+        self.encoding = encoding
+
+    def value(self, i):
+        return self.source[self.starts[i]:self.ends[i]].decode(self.encoding)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return Token(self.types[i], self.value(i))
+
+
 class Lexer(object):
-    """TODO: move tokenize() from template.py"""
+    """
+    Whitespace control: a tag opened with {{- or {%- strips the whitespace
+    before it, one closed with -}} or -%} the whitespace after it.
+    trim_blocks: drop the first newline after a block tag.
+    lstrip_blocks: strip spaces and tabs from the start of a line up to a
+    block tag.
+    Whitespace is stripped by narrowing the DATA tokens, nothing is copied.
+
+    Besides str, tokenize() accepts bytes-like sources such as a mmap of
+    the template file, in `encoding`, which has to be ASCII compatible.
+    """
+
+    BEGIN_PATTERN = re.compile(r"{{-?|{%-?")
+    BLOCK_BEGIN = frozenset(["{%", "{%-"])
+    # ASCII whitespace only, a non-breaking space is text
+    SPACES = " \t\n\r\f\v"
+    WHITESPACE_PATTERN = re.compile(r"[ \t\n\r\f\v]*")
+    NEWLINE_PATTERN = re.compile(r"\r?\n")
+    INDENT_PATTERN = re.compile(r"[ \t]*")
+    NEWLINE = "\n"
+    TOKEN_PATTERN = re.compile(r"""[ \t\n\r\f\v]*(?:
+        (?P<VARIABLE_END>-?}})
+      | (?P<BLOCK_END>-?%})
+      | (?P<NAME>[a-zA-Z_][a-zA-Z0-9_]*)
+      | (?P<INTEGER>[0-9]+)
+      | '(?P<STRING>[^']*)'
+      | "(?P<DSTRING>[^"]*)"
+      | (?P<SYMBOL>[-+*/%\[\].])
+    )""", re.VERBOSE)
+
+    SYMBOLS = {
+        "[": TokenType.LBRACKET,
+        "]": TokenType.RBRACKET,
+        ".": TokenType.DOT,
+        "+": TokenType.ADD,
+        "-": TokenType.SUB,
+        "*": TokenType.MUL,
+        "/": TokenType.DIV,
+        "%": TokenType.MOD,
+    }
+
+    # state -> {token type: next state}, None finishes the tag
+    _OPERATORS = {
+        TokenType.ADD: "operand",
+        TokenType.SUB: "operand",
+        TokenType.MUL: "operand",
+        TokenType.DIV: "operand",
+        TokenType.MOD: "operand",
+    }
+    VARIABLE_STATES = {
+        "operand": {TokenType.NAME: "name", TokenType.INTEGER: "operator"},
+        "name": {TokenType.LBRACKET: "index", TokenType.DOT: "attribute", TokenType.VARIABLE_END: None, **_OPERATORS},
+        "index": {TokenType.INTEGER: "rbracket", TokenType.STRING: "rbracket"},
+        # back to "name" to allow chains such as a.b[0].c
+        "rbracket": {TokenType.RBRACKET: "name"},
+        "attribute": {TokenType.NAME: "name"},
+        "operator": {TokenType.VARIABLE_END: None, **_OPERATORS},
+    }
+    BLOCK_STATES = {
+        "operand": {TokenType.NAME: "arguments"},
+        "arguments": {
+            TokenType.NAME: "arguments",
+            TokenType.INTEGER: "arguments",
+            TokenType.STRING: "arguments",
+            TokenType.DOT: "arguments",
+            TokenType.LBRACKET: "arguments",
+            TokenType.RBRACKET: "arguments",
+            TokenType.BLOCK_END: None,
+        },
+    }
+
+    def __init__(self, trim_blocks=False, lstrip_blocks=False, encoding="utf-8"):
+        self.trim_blocks = trim_blocks
+        self.lstrip_blocks = lstrip_blocks
+        self.encoding = encoding
+
+    def tokenize(self, content):
+        if isinstance(content, str):
+            tokens = TokenStream(content)
+            patterns = self
+        else:
+            tokens = EncodedTokenStream(content, self.encoding)
+            patterns = _BytesPatterns
+        pos = 0
+        end = len(content)
+
+        while pos < end:
+            m = patterns.BEGIN_PATTERN.search(content, pos)
+            if m is None:
+                tokens.append(TokenType.DATA, pos, end)
+                break
+
+            data_end = m.start()
+            is_block = m.group() in patterns.BLOCK_BEGIN
+            if m.end() - data_end == 3:
+                data_end = pos + len(content[pos:data_end].rstrip(patterns.SPACES))
+            elif is_block and self.lstrip_blocks:
+                data_end = self._lstrip_block(content, pos, data_end, patterns)
+            if data_end > pos:
+                tokens.append(TokenType.DATA, pos, data_end)
+
+            if is_block:
+                tokens.append(TokenType.BLOCK_BEGIN, m.start(), m.end())
+                pos = self._tokenize_tag(content, m.end(), self.BLOCK_STATES, tokens, patterns)
+            else:
+                tokens.append(TokenType.VARIABLE_BEGIN, m.start(), m.end())
+                pos = self._tokenize_tag(content, m.end(), self.VARIABLE_STATES, tokens, patterns)
+
+            if tokens.ends[-1] - tokens.starts[-1] == 3:
+                # closed with -}} or -%}
+                pos = patterns.WHITESPACE_PATTERN.match(content, pos).end()
+            elif is_block and self.trim_blocks:
+                m = patterns.NEWLINE_PATTERN.match(content, pos)
+                if m is not None:
+                    pos = m.end()
+
+        return tokens
+
+    def _lstrip_block(self, content, start, end, patterns):
+        """end of the data before a block tag at `end`, without the indentation of the tag's line"""
+        line_start = content.rfind(patterns.NEWLINE, max(start - 1, 0), end) + 1
+        if line_start == 0 and start > 0:
+            return end
+        if patterns.INDENT_PATTERN.fullmatch(content, line_start, end) is not None:
+            return line_start
+        return end
+
+    def _tokenize_tag(self, content, pos, states, tokens, patterns):
+        state = "operand"
+        while True:
+            m = patterns.TOKEN_PATTERN.match(content, pos)
+            if m is None:
+                raise SyntaxError(f"unexpected character at position {pos}")
+
+            kind = m.lastgroup
+            if kind == "SYMBOL":
+                type = patterns.SYMBOLS[m.group(kind)]
+            elif kind == "DSTRING":
+                type = TokenType.STRING
+            else:
+                type = TokenType[kind]
+
+            transitions = states[state]
+            if type not in transitions:
+                text = m.group().strip()
+                if not isinstance(text, str):
+                    text = text.decode(self.encoding, "replace")
+                raise SyntaxError(f"unexpected '{text}' at position {m.start(kind)}")
+
+            tokens.append(type, m.start(kind), m.end(kind))
+            pos = m.end()
+
+            state = transitions[type]
+            if state is None:
+                return pos
+
+
+def _bytes_pattern(pattern):
+    return re.compile(pattern.pattern.encode("ascii"), pattern.flags & ~re.UNICODE)
+
+
+class _BytesPatterns(object):
+    """the patterns of Lexer, for bytes-like sources"""
+
+    BEGIN_PATTERN = _bytes_pattern(Lexer.BEGIN_PATTERN)
+    WHITESPACE_PATTERN = _bytes_pattern(Lexer.WHITESPACE_PATTERN)
+    NEWLINE_PATTERN = _bytes_pattern(Lexer.NEWLINE_PATTERN)
+    INDENT_PATTERN = _bytes_pattern(Lexer.INDENT_PATTERN)
+    TOKEN_PATTERN = _bytes_pattern(Lexer.TOKEN_PATTERN)
+    BLOCK_BEGIN = frozenset([b"{%", b"{%-"])
+    SPACES = Lexer.SPACES.encode("ascii")
+    NEWLINE = b"\n"
+    SYMBOLS = {symbol.encode("ascii"): type for symbol, type in Lexer.SYMBOLS.items()}
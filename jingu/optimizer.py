@@ -0,0 +1,94 @@
+import re
+
+from .template import CacheNode, CalcNode, ConstNode, DataNode, ForNode, Frame, IfNode, NameNode, SkipNode
+
+
+def optimize(nodes):
+    """
+    Fold constant expressions into static text and merge neighbouring
+    static text, so output() yields fewer and larger pieces.
+    """
+    folded = []
+    for n in nodes:
+        folded.extend(fold(n))
+    return coalesce(folded)
+
+
+def fold(node):
+    """return the nodes that replace `node`"""
+    if isinstance(node, SkipNode):
+        return []
+
+    if isinstance(node, (ConstNode, CalcNode)) and is_constant(node):
+        try:
+            value = eval(node.expr(Frame()), {"__builtins__": {}})
+        except ArithmeticError:
+            # e.g. 1 / 0, leave it to fail at render time as before
+            return [node]
+        return [DataNode(str(value))]
+
+    if isinstance(node, (IfNode, ForNode, CacheNode)):
+        node.body = optimize(node.body)
+
+    if isinstance(node, IfNode) and isinstance(node.test, NameNode) and node.test.value in Frame.CONSTANTS:
+        if node.test.value == "True":
+            return node.body
+        return []
+
+    return [node]
+
+
+def is_constant(node):
+    if isinstance(node, ConstNode):
+        return True
+    if isinstance(node, CalcNode):
+        return is_constant(node.left) and is_constant(node.right)
+    return False
+
+
+def coalesce(nodes):
+    result = []
+    for n in nodes:
+        if isinstance(n, DataNode) and result and isinstance(result[-1], DataNode):
+            result[-1] = DataNode(result[-1].value + n.value)
+        else:
+            result.append(n)
+    return result
+
+
+# ASCII whitespace only, a non-breaking space is text
+WHITESPACE_PATTERN = re.compile(r"[ \t\n\r\f\v]+")
+# whitespace is kept as is inside these elements
+PRESERVE_PATTERN = re.compile(r"<(/?)(?:pre|textarea|script|style)\b", re.IGNORECASE)
+
+
+def collapse_whitespace(nodes, depth=None):
+    """
+    Replace whitespace runs in static text by one newline, if the run has
+    one, or one space, except inside <pre>, <textarea>, <script> and
+    <style>. `depth` counts the open preserving elements across nodes, in
+    document order.
+    """
+    if depth is None:
+        depth = [0]
+    for n in nodes:
+        if isinstance(n, DataNode):
+            n.value = collapse_text(n.value, depth)
+        body = getattr(n, "body", None)
+        if body:
+            collapse_whitespace(body, depth)
+
+
+def collapse_text(text, depth):
+    pieces = []
+    pos = 0
+    for m in PRESERVE_PATTERN.finditer(text):
+        pieces.append(collapse_run(text[pos:m.start()]) if depth[0] == 0 else text[pos:m.start()])
+        depth[0] = max(0, depth[0] + (-1 if m.group(1) else 1))
+        pos = m.start()
+    pieces.append(collapse_run(text[pos:]) if depth[0] == 0 else text[pos:])
+    return "".join(pieces)
+
+
+def collapse_run(text):
+    return WHITESPACE_PATTERN.sub(lambda m: "\n" if "\n" in m.group() else " ", text)
@@ -0,0 +1,327 @@
+from collections.abc import Mapping
+import inspect
+import operator
+from operator import attrgetter, itemgetter
+import string
+
+__all__ = [
+    "async_cached_fragment",
+    "async_lookahead",
+    "auto_aiter",
+    "auto_await",
+    "await_name",
+    "cached_fragment",
+    "escape_str",
+    "fragment_key",
+    "getter",
+    "lookahead",
+]
+
+
+_MISSING = object()
+
+
+class Lazy(object):
+    """
+    Context value computed by calling `func` the first time a template
+    uses it, at most once. Until then it is passed around as is, so values
+    the rendering doesn't reach, e.g. in an {% if %} branch not taken, are
+    never computed. Afterwards it behaves like the computed value.
+    """
+
+    __slots__ = ("_func", "_value")
+
+    def __init__(self, func):
+        self._func = func
+        self._value = _MISSING
+
+    def resolve(self):
+        value = self._value
+        if value is _MISSING:
+            value = self._value = self._func()
+            self._func = None
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        if self._value is _MISSING:
+            return f"Lazy({self._func!r})"
+        return f"Lazy(value={self._value!r})"
+
+    def __str__(self):
+        return str(self.resolve())
+
+    def __bool__(self):
+        return bool(self.resolve())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __contains__(self, item):
+        return item in self.resolve()
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __eq__(self, other):
+        return self.resolve() == other
+
+    def __hash__(self):
+        return hash(self.resolve())
+
+
+def _forward(op):
+    def method(self, other):
+        return op(self.resolve(), other)
+
+    def reflected(self, other):
+        return op(other, self.resolve())
+
+    return method, reflected
+
+
+# the arithmetic of {{ a + b }} and comparisons
+for _name in ("add", "sub", "mul", "truediv", "floordiv", "mod"):
+    _method, _reflected = _forward(getattr(operator, _name))
+    setattr(Lazy, f"__{_name}__", _method)
+    setattr(Lazy, f"__r{_name}__", _reflected)
+for _name in ("ne", "lt", "le", "gt", "ge"):
+    setattr(Lazy, f"__{_name}__", _forward(getattr(operator, _name))[0])
+
+
+class Markup(str):
+    """str that is safe HTML already, autoescaping passes it through as is"""
+
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+    def __add__(self, other):
+        return Markup(str.__add__(self, escape(other)))
+
+    def __radd__(self, other):
+        return Markup(str.__add__(escape(other), self))
+
+    def __mod__(self, args):
+        if isinstance(args, tuple):
+            args = tuple(_escape_argument(arg) for arg in args)
+        elif isinstance(args, Mapping):
+            args = {key: _escape_argument(value) for key, value in args.items()}
+        else:
+            args = _escape_argument(args)
+        return Markup(str.__mod__(self, args))
+
+    def join(self, iterable):
+        return Markup(str.join(self, map(escape, iterable)))
+
+    def format(self, *args, **kwargs):
+        return Markup(_ESCAPE_FORMATTER.vformat(self, args, kwargs))
+
+    def format_map(self, mapping):
+        return Markup(_ESCAPE_FORMATTER.vformat(self, (), mapping))
+
+    def __repr__(self):
+        return f"Markup({str.__repr__(self)})"
+
+    @classmethod
+    def escape(cls, value):
+        return escape(value)
+
+
+def escape_str(value):
+    """
+    str of `value` with &, <, >, " and ' replaced by HTML entities, used by
+    autoescaped templates. Objects with an __html__() method such as Markup
+    are passed through, numbers can't contain special characters.
+    """
+    cls = value.__class__
+    if cls is not str:
+        if cls is int or cls is float or cls is bool:
+            return str(value)
+        if hasattr(value, "__html__"):
+            return value.__html__()
+        value = str(value)
+    # str.replace() returns the string itself when there is nothing to
+    # replace, this is faster than a regex or str.translate()
+    return (
+        value.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&#34;")
+        .replace("'", "&#39;")
+    )
+
+
+def escape(value):
+    """Markup of `value` with HTML special characters escaped"""
+    return Markup(escape_str(value))
+
+
+def _escape_argument(value):
+    """a % argument of Markup, escaped unless it is a number for %d & co."""
+    if isinstance(value, (int, float)):
+        return value
+    return escape(value)
+
+
+class _EscapeFormatter(string.Formatter):
+    """formats the fields of Markup.format() and escapes them"""
+
+    def format_field(self, value, format_spec):
+        if not format_spec and hasattr(value, "__html__"):
+            return value.__html__()
+        return escape_str(format(value, format_spec))
+
+
+_ESCAPE_FORMATTER = _EscapeFormatter()
+
+
+# errors meaning "no such item/attribute", the other kind of lookup is tried
+LOOKUP_ERRORS = (AttributeError, KeyError, IndexError, TypeError)
+# types remembered by one getter
+GETTER_CACHE_SIZE = 8
+
+
+def getter(key, attribute=False):
+    """
+    Function doing the lookup of `obj.key` (attribute=True) or `obj[key]` at
+    one place in a template. Attribute lookups fall back to items and the
+    other way round, dicts always prefer items. The lookup that worked for
+    an object is remembered for its type, so later objects of the same type
+    are resolved by one C-level attrgetter/itemgetter call.
+
+    `get.type` is the last type, other than dict, for which the lookup
+    written in the template (`.key` or `[key]`) worked first. The generated
+    code does that lookup inline for objects of this type, without calling
+    get(); an object of this type that lacks the attribute or item then
+    raises instead of trying the other kind of lookup.
+    """
+    get_item = itemgetter(key)
+    get_attr = attrgetter(key) if isinstance(key, str) else None
+    written = get_attr if attribute else get_item
+    # lookups on the computed value of Lazy objects are cached by its type
+    cache = {Lazy: lambda obj: get(obj.resolve())}
+    # most places only ever see one type, checked before the cache; the
+    # (type, lookup) pair is replaced as a whole so that threads sharing
+    # the template never see the type of one and the lookup of another
+    last = (None, None)
+
+    def resolve(obj):
+        nonlocal last
+        if attribute and not isinstance(obj, dict):
+            lookups = (get_attr, get_item)
+        else:
+            lookups = (get_item, get_attr)
+
+        error = None
+        for lookup in lookups:
+            if lookup is None:
+                continue
+            try:
+                value = lookup(obj)
+            except LOOKUP_ERRORS as e:
+                error = error or e
+                continue
+            if len(cache) <= GETTER_CACHE_SIZE:
+                cache[obj.__class__] = lookup
+            last = (obj.__class__, lookup)
+            if lookup is written and obj.__class__ is not dict:
+                get.type = obj.__class__
+            return value
+        raise error
+
+    def get(obj):
+        try:
+            last_type, last_lookup = last
+            if obj.__class__ is last_type:
+                return last_lookup(obj)
+            return cache[obj.__class__](obj)
+        except LOOKUP_ERRORS:
+            # new type, or this object lacks what others of its type had
+            return resolve(obj)
+
+    get.type = None
+    return get
+
+
+def fragment_key(digest, *parts):
+    """key of a {% cache %} fragment, `digest` identifies the code of its body"""
+    return digest + "".join(["\x1f" + str(part) for part in parts])
+
+
+def cached_fragment(cache, key, ttl, render):
+    """output of the generator function `render`, from `cache` when it has it"""
+    if cache is None:
+        return "".join(render())
+    value = cache.get(key)
+    if value is None:
+        value = "".join(render())
+        cache.set(key, value, ttl)
+    return value
+
+
+async def async_cached_fragment(cache, key, ttl, render):
+    if cache is not None:
+        value = cache.get(key)
+        if value is not None:
+            return value
+    value = "".join([chunk async for chunk in render()])
+    if cache is not None:
+        cache.set(key, value, ttl)
+    return value
+
+
+async def auto_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def await_name(context, name):
+    """
+    context[name], awaited where a template first reads it; the result
+    replaces the awaitable so that later reads don't await it again
+    """
+    value = context[name]
+    if inspect.isawaitable(value):
+        value = context[name] = await value
+    return value
+
+
+async def auto_aiter(iterable):
+    if hasattr(iterable, "__aiter__"):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def lookahead(iterable):
+    """yield (item, is_last) pairs, reading one item ahead"""
+    it = iter(iterable)
+    try:
+        current = next(it)
+    except StopIteration:
+        return
+    for item in it:
+        yield current, False
+        current = item
+    yield current, True
+
+
+async def async_lookahead(iterable):
+    first = True
+    async for item in auto_aiter(iterable):
+        if not first:
+            yield current, False
+        current = item
+        first = False
+    if not first:
+        yield current, True
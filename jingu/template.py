@@ -1,451 +1,1363 @@
-from io import StringIO
-import re
-
-from .lexer import Lexer, Token, TokenType
+import asyncio
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import importlib.util
+from io import BufferedIOBase, RawIOBase, StringIO, TextIOBase
+from itertools import islice, repeat
+import keyword
+import marshal
+import mmap
+import os
+import threading
+import time
+import warnings
+
+from . import runtime
+from .fragcache import MemoryFragmentCache
+from .lexer import Lexer, TokenStream, TokenType
 
 
 class ParseError(Exception):
     pass
 
 
-class Environment(object):
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+# passed to Environment observers
+# event: "get_template" or "render"
+# phases: {phase name: seconds}, e.g. load, tokenize, parse, codegen, compile, render
+# output_size: length of the rendered output, None for get_template
+# cache_hit: whether the compiled template was reused
+TemplateEvent = namedtuple("TemplateEvent", ["event", "name", "phases", "output_size", "cache_hit"])
+
+
+def normalize_name(name):
+    return os.path.normpath(name).replace(os.sep, "/")
+
+
+def precompiled_module_name(name):
+    """
+    module name used by `python -m jingu compile` for the template `name`,
+    relative to the templates directory
+    """
+    return "tmpl_" + hashlib.sha1(normalize_name(name).encode("utf-8")).hexdigest()
+
+
+class _CacheEntry(object):
+    __slots__ = ("template", "path", "mtime", "size", "checked", "dependencies")
+
+    def __init__(self, template, path, mtime, size, checked, dependencies=None):
+        self.template = template
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.checked = checked
+        # {path: (mtime, size)} of the included and extended templates
+        self.dependencies = dependencies or {}
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _is_binary(fp):
+    """
+    whether `fp` takes bytes: binary io classes and objects whose mode has
+    a "b", other writers, e.g. ones with just a write() method, take str
+    """
+    if isinstance(fp, TextIOBase):
+        return False
+    if isinstance(fp, (RawIOBase, BufferedIOBase)):
+        return True
+    mode = getattr(fp, "mode", None)
+    return isinstance(mode, str) and "b" in mode
+
+
+def _hash_source(source):
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class CompileReport(object):
+    """result of Environment.compile_templates()"""
+
     def __init__(self):
-        pass
+        self.compiled = []
+        self.errors = {}
+        self.seconds = 0.0
+
+    @property
+    def throughput(self):
+        """compiled templates per second"""
+        if not self.seconds:
+            return 0.0
+        return len(self.compiled) / self.seconds
+
+    def __repr__(self):
+        return (f"CompileReport(compiled={len(self.compiled)}, errors={len(self.errors)}, "
+                f"seconds={self.seconds:.3f})")
+
+
+def _compile_file(template_file, options, kind):
+    """compile one template file, runs in worker processes"""
+    env = Environment(cache_size=0, **options)
+    with open(template_file, "r") as f:
+        st = os.fstat(f.fileno())
+        source = f.read()
+
+    template = Template(source, name=normalize_name(template_file), environment=env)
+    if kind == "module":
+        return template_file, template.module_source()
+    return template_file, (source, marshal.dumps(template.compile()), st.st_mtime_ns, st.st_size)
+
+
+def _compile_file_safe(template_file, options, kind):
+    """like _compile_file() but returns (error, result) instead of raising"""
+    try:
+        return None, _compile_file(template_file, options, kind)[1]
+    except Exception as e:
+        return f"{type(e).__name__}: {e}", None
+
+
+# output() of the template rendered by a render_many() worker process
+_worker_render_func = None
+
+
+def _init_render_worker(data):
+    """receives the marshalled template code once per worker process"""
+    global _worker_render_func
+    # {% cache %} fragments are rendered every time in workers
+    namespace = {"fragment_cache": None}
+    exec(marshal.loads(data), namespace)
+    _worker_render_func = namespace["output"]
+
+
+def _render_chunk(contexts):
+    func = _worker_render_func
+    return [''.join(func(dict(context))) for context in contexts]
+
+
+class Environment(object):
+    """
+    cache_size: maximum number of compiled templates kept, 0 disables the
+    cache and a negative value makes it unbounded.
+    auto_reload: reload cached templates whose file mtime or size changed.
+    check_interval: seconds between two stat() calls for the same template.
+    bytecode_cache: optional FileSystemBytecodeCache used to skip compiling
+    templates that were already compiled by another process.
+    precompiled_dir: directory written by `python -m jingu compile`; templates
+    found there are imported instead of being compiled from source.
+    templates_dir: the directory passed to `python -m jingu compile`; the
+    modules are named after the path of the template relative to it, so
+    get_template() finds them whichever way the path is spelled and from
+    any working directory. The working directory by default.
+    autoescape: HTML-escape the result of every expression that isn't Markup.
+    trim_blocks, lstrip_blocks: whitespace control around block tags, see
+    Lexer.
+    minify: collapse whitespace runs in the static text of templates.
+    fragment_cache: store of the {% cache %} tags, a MemoryFragmentCache
+    by default, see jingu.fragcache.
+    mmap_threshold: template files of at least this many bytes are mapped
+    into memory and compiled from the mapping instead of being read into a
+    str, only the code is kept; they have to be utf-8 encoded, files with
+    CR line endings are read as text. None never maps.
+
+    Callbacks registered with add_observer() receive a TemplateEvent for
+    every get_template() call and every render of a template, whichever
+    method renders it; output_size is in bytes for the bytes variants.
+    Without observers no timing is done at all.
+
+    Included and extended templates are inlined when a template is compiled,
+    so the cache records the files each template was built from; a change to
+    one of them only reloads the templates depending on it.
+    """
+
+    def __init__(self, cache_size=400, auto_reload=True, check_interval=1.0, bytecode_cache=None,
+                 precompiled_dir=None, autoescape=False, fragment_cache=None, trim_blocks=False,
+                 lstrip_blocks=False, minify=False, mmap_threshold=None, templates_dir=None):
+        self.cache_size = cache_size
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        self.bytecode_cache = bytecode_cache
+        self.precompiled_dir = precompiled_dir
+        self.templates_dir = templates_dir
+        self.autoescape = autoescape
+        self.trim_blocks = trim_blocks
+        self.lstrip_blocks = lstrip_blocks
+        self.minify = minify
+        self.mmap_threshold = mmap_threshold
+        self.fragment_cache = fragment_cache if fragment_cache is not None else MemoryFragmentCache()
+
+        self._cache = OrderedDict()
+        # dependency path -> names of the cached templates built from it
+        self._dependents = {}
+        self._lock = threading.Lock()
+        # template file -> lock held while it is being loaded
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.observers = []
+
+    def add_observer(self, callback):
+        self.observers.append(callback)
+
+    def remove_observer(self, callback):
+        self.observers.remove(callback)
+
+    def notify(self, event):
+        for callback in list(self.observers):
+            callback(event)
 
     def get_template(self, template_file):
+        if not self.observers:
+            return self._get_template(template_file, None)
+
+        phases = {}
+        start = time.perf_counter()
+        template = self._get_template(template_file, phases)
+        phases["get_template"] = time.perf_counter() - start
+        self.notify(TemplateEvent("get_template", template_file, phases, None, "load" not in phases))
+        return template
+
+    def _get_template(self, template_file, phases):
+        if self.cache_size == 0:
+            self.misses += 1
+            return self._load_template(template_file, phases).template
+
+        with self._lock:
+            entry = self._cache.get(template_file)
+            if entry is not None and not self._is_stale(entry):
+                self._cache.move_to_end(template_file)
+                self.hits += 1
+                return entry.template
+            self.misses += 1
+            loading = self._loading.setdefault(template_file, threading.Lock())
+
+        # threads missing the same template wait for the first one to load
+        # it, so they all share one compiled template
+        with loading:
+            try:
+                with self._lock:
+                    entry = self._cache.get(template_file)
+                    if entry is not None and not self._is_stale(entry):
+                        return entry.template
+
+                entry = self._load_template(template_file, phases)
+                self._store_entry(template_file, entry)
+                return entry.template
+            finally:
+                with self._lock:
+                    if self._loading.get(template_file) is loading:
+                        del self._loading[template_file]
+
+    def _store_entry(self, template_file, entry):
+        with self._lock:
+            old = self._cache.pop(template_file, None)
+            if old is not None:
+                self._forget_dependencies(template_file, old)
+            self._cache[template_file] = entry
+            for path in entry.dependencies:
+                self._dependents.setdefault(path, set()).add(template_file)
+            while 0 < self.cache_size < len(self._cache):
+                name, evicted = self._cache.popitem(last=False)
+                self._forget_dependencies(name, evicted)
+                self.evictions += 1
+
+    def _forget_dependencies(self, template_file, entry):
+        for path in entry.dependencies:
+            dependents = self._dependents.get(path)
+            if dependents is not None:
+                dependents.discard(template_file)
+                if not dependents:
+                    del self._dependents[path]
+
+    def dependents(self, path):
+        """names of the cached templates that include or extend the template file `path`"""
+        with self._lock:
+            return set(self._dependents.get(os.path.normpath(path), ()))
+
+    def invalidate(self, path):
+        """
+        drop the template file `path` and every cached template built from
+        it, return the names of the dropped templates
+        """
+        path = os.path.normpath(path)
+        with self._lock:
+            names = set(self._dependents.get(path, ()))
+            names.update(name for name in self._cache if os.path.normpath(name) == path)
+            for name in names:
+                self._forget_dependencies(name, self._cache.pop(name))
+        return names
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.cache_size, len(self._cache))
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._dependents.clear()
+
+    def _load_template(self, template_file, phases=None):
+        start = time.perf_counter()
+        if self.precompiled_dir is not None:
+            entry = self._load_precompiled(template_file)
+            if entry is not None:
+                if phases is not None:
+                    phases["load"] = time.perf_counter() - start
+                return entry
+
         with open(template_file, "r") as f:
-            return Template(f.read())
+            st = os.fstat(f.fileno())
+            mapped = False
+            # empty files can't be mapped
+            if self.mmap_threshold is not None and st.st_size >= max(self.mmap_threshold, 1):
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                mapped = source.find(b"\r") == -1
+                if not mapped:
+                    # read as text, with its newlines translated like any other file
+                    source.close()
+            if not mapped:
+                source = f.read()
+        if phases is not None:
+            phases["load"] = time.perf_counter() - start
+
+        template = self._compile_template(source, template_file, phases)
+        if mapped:
+            # the file may be changed or truncated once loaded, nothing may
+            # read the mapping after this
+            template._release_source((st.st_mtime_ns, st.st_size))
+            source.close()
+        return self._make_entry(template, template_file, st.st_mtime_ns, st.st_size)
+
+    def _make_entry(self, template, template_file, mtime, size):
+        dependencies = {path: _stat(path) for path in template.dependencies}
+        return _CacheEntry(template, template_file, mtime, size, time.monotonic(), dependencies)
+
+    def _precompiled_module_name(self, template_file):
+        root = self.templates_dir if self.templates_dir is not None else os.curdir
+        return precompiled_module_name(os.path.relpath(os.path.abspath(template_file), os.path.abspath(root)))
+
+    def _load_precompiled(self, template_file):
+        module_name = self._precompiled_module_name(template_file)
+        path = os.path.join(self.precompiled_dir, module_name + ".py")
+        try:
+            st = os.stat(path)
+        except OSError:
+            warnings.warn(
+                f"no precompiled module for '{template_file}' in '{self.precompiled_dir}', compiling it from source",
+                RuntimeWarning,
+            )
+            return None
+
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if getattr(module, "compile_options", None) != self.compile_options():
+            # compiled with other settings, e.g. without autoescape
+            return None
+
+        template = Template.from_module(module, name=template_file, environment=self)
+        return _CacheEntry(template, path, st.st_mtime_ns, st.st_size, time.monotonic())
+
+    def write_precompiled(self, template_file, out_dir):
+        """compile `template_file` into an importable module in `out_dir`, return its path"""
+        _, module_source = _compile_file(template_file, self.compile_options(), "module")
+        return self._write_module(template_file, module_source, out_dir)
+
+    def _write_module(self, template_file, module_source, out_dir):
+        path = os.path.join(out_dir, self._precompiled_module_name(template_file) + ".py")
+        with open(path, "w") as f:
+            f.write(module_source)
+        return path
+
+    def compile_options(self):
+        """keyword arguments recreating the settings that affect generated code"""
+        return {name: getattr(self, name) for name in Template.COMPILE_OPTIONS}
+
+    def compile_templates(self, paths, workers=None, out_dir=None):
+        """
+        Compile many templates in a process pool.
+
+        Without `out_dir` the compiled templates are stored in this
+        environment's cache and in its bytecode cache, if it has one. With
+        `out_dir` precompiled modules are written there instead, see
+        `python -m jingu compile`. A failing template doesn't stop the
+        batch, its error is recorded in the returned CompileReport.
+        workers: number of processes, None for one per CPU, 1 to compile in
+        this process.
+        """
+        paths = list(paths)
+        kind = "module" if out_dir is not None else "code"
+        options = self.compile_options()
+        report = CompileReport()
+        start = time.perf_counter()
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(paths) // (workers * 4))
+                results = executor.map(_compile_file_safe, paths, repeat(options), repeat(kind), chunksize=chunksize)
+                self._collect_compiled(paths, results, out_dir, report)
+        else:
+            results = (_compile_file_safe(path, options, kind) for path in paths)
+            self._collect_compiled(paths, results, out_dir, report)
+
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def _collect_compiled(self, paths, results, out_dir, report):
+        for path, (error, result) in zip(paths, results):
+            if error is not None:
+                report.errors[path] = error
+                continue
+
+            try:
+                if out_dir is not None:
+                    self._write_module(path, result, out_dir)
+                else:
+                    self._store_compiled(path, *result)
+            except Exception as e:
+                report.errors[path] = f"{type(e).__name__}: {e}"
+                continue
+            report.compiled.append(path)
+
+    def _store_compiled(self, template_file, source, data, mtime, size):
+        code = marshal.loads(data)
+        if self.bytecode_cache is not None:
+            self.bytecode_cache.dump(source, code, self.compile_options())
+        if self.cache_size == 0:
+            return
+
+        template = Template.from_code(source, code, name=template_file, environment=self)
+        self._store_entry(template_file, self._make_entry(template, template_file, mtime, size))
+
+    def _compile_template(self, source, name=None, phases=None):
+        if self.bytecode_cache is not None:
+            start = time.perf_counter()
+            code = self.bytecode_cache.load(source, self.compile_options())
+            if phases is not None:
+                phases["bytecode_cache"] = time.perf_counter() - start
+            if code is not None:
+                template = Template.from_code(source, code, name=name, environment=self)
+                # the key only covers this template's own source
+                if not self._dependencies_changed(template.dependencies):
+                    return template
+
+        template = Template(source, name=name, environment=self)
+        if phases is not None or self.bytecode_cache is not None:
+            template._code = template.compile(timings=phases)
+        if self.bytecode_cache is not None:
+            self.bytecode_cache.dump(source, template.code, self.compile_options())
+        return template
+
+    def _dependencies_changed(self, dependencies):
+        for path, digest in dependencies.items():
+            try:
+                with open(path, "r") as f:
+                    source = f.read()
+            except OSError:
+                return True
+            if _hash_source(source) != digest:
+                return True
+        return False
+
+    def _is_stale(self, entry):
+        if not self.auto_reload:
+            return False
+
+        now = time.monotonic()
+        if now - entry.checked < self.check_interval:
+            return False
+        entry.checked = now
+
+        if _stat(entry.path) != (entry.mtime, entry.size):
+            return True
+        for path, stat in entry.dependencies.items():
+            if _stat(path) != stat:
+                return True
+        return False
 
 
 class Template(object):
-    NAME_PATTERN = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
-    VARIABLE_BEGIN_PATTERN = re.compile(r"{{")
-    VARIABLE_END_PATTERN = re.compile(r"}}")
-    BLOCK_BEGIN_PATTERN = re.compile(r"{%")
-    BLOCK_END_PATTERN = re.compile(r"%}")
-    LBRACKET_PATTERN = re.compile(r"\[")
-    RBRACKET_PATTERN = re.compile(r"]")
-    INTEGER_PATTERN = re.compile(r"[0-9]+")
-    STRING_PATTERN = re.compile(r"'(.*?)'|\"(.*?)\"")
-    DOT_PATTERN = re.compile(r"\.")
-    ADD_PATTERN = re.compile(r"\+")
-    SUB_PATTERN = re.compile(r"-")
-    MUL_PATTERN = re.compile(r"\*")
-    DIV_PATTERN = re.compile(r"/")
-    MOD_PATTERN = re.compile(r"%")
-
-    def __init__(self, source):
+    """
+    A compiled template. One instance can be rendered by many threads at
+    once: the code is compiled once, under a lock, and rendering keeps all
+    its state in the locals of the generated function. The settings and
+    the source must not be changed once the template is in use.
+    """
+
+    # used by render_to() when writing to binary files and by render_bytes()
+    encoding = "utf-8"
+    write_buffer_size = 65536
+    # generate_async() yields to the event loop after this many pieces
+    async_yield_every = 256
+    # run the optimizer between parse() and code generation
+    optimized = True
+    # settings affecting the generated code, see Environment; they are
+    # taken from the environment unless given as keyword arguments
+    COMPILE_OPTIONS = ("autoescape", "trim_blocks", "lstrip_blocks", "minify")
+    autoescape = False
+    trim_blocks = False
+    lstrip_blocks = False
+    minify = False
+
+    def __init__(self, source, name=None, environment=None, **options):
         self.source = source
-        self.stream = StringIO()
+        self.name = name
+        self.environment = environment
+        for option in options:
+            if option not in self.COMPILE_OPTIONS:
+                raise TypeError(f"unexpected option '{option}'")
+        if environment is not None:
+            options = {**environment.compile_options(), **options}
+        for option, value in options.items():
+            setattr(self, option, value)
+        # without an environment {% cache %} renders its body every time
+        self.fragment_cache = environment.fragment_cache if environment is not None else None
+        # the environment's observer list, shared so that render() only
+        # needs a truth test to know whether to collect timings
+        self._observers = environment.observers if environment is not None else ()
+        self._code = None
+        self._async_code = None
+        self._bytes_code = None
+        self._render_func = None
+        self._async_render_func = None
+        self._bytes_render_func = None
+        self._dependencies = None
+        self._referenced_names = None
+        # (mtime, size) of the mapped file the source was released from,
+        # see Environment(mmap_threshold)
+        self._mapped_stat = None
+        # taken to compile and parse, reentrant since the code of one
+        # variant is needed to build another
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_code(cls, source, code, name=None, environment=None):
+        template = cls(source, name=name, environment=environment)
+        template._code = code
+        return template
+
+    @classmethod
+    def from_module(cls, module, name=None, environment=None):
+        """template backed by a module written by module_source()"""
+        template = cls(None, name=name, environment=environment)
+        module.fragment_cache = template.fragment_cache
+        template._render_func = module.output
+        template._async_render_func = module.output_async
+        template._bytes_render_func = module.output_bytes
+        template._dependencies = getattr(module, "dependencies", {})
+        template._referenced_names = frozenset(getattr(module, "referenced_names", ()))
+        return template
+
+    def compile_options(self):
+        """the settings the generated code depends on"""
+        return {name: getattr(self, name) for name in self.COMPILE_OPTIONS}
+
+    def _build(self, name, build):
+        """set the attribute `name` to build() unless another thread did it first"""
+        with self._lock:
+            if getattr(self, name) is None:
+                setattr(self, name, build())
 
-    def _match_operators(self, content, pos):
-        return self.ADD_PATTERN.match(content, pos) \
-            or self.SUB_PATTERN.match(content, pos) \
-            or self.MUL_PATTERN.match(content, pos) \
-            or self.DIV_PATTERN.match(content, pos) \
-            or self.MOD_PATTERN.match(content, pos)
+    @property
+    def code(self):
+        """compiled code object defining output(), built on first use"""
+        if self._code is None:
+            self._build("_code", self.compile)
+        return self._code
 
-    def render(self, *args, **kwargs):
-        tokens = self.tokenize(self.source)
-        nodes = self.parse(tokens)
-        for n in nodes:
-            self.stream.write(n.visit())
+    @property
+    def async_code(self):
+        """compiled code object defining the async generator variant of output()"""
+        if self._async_code is None:
+            self._build("_async_code", lambda: self.compile(is_async=True))
+        return self._async_code
 
-        code = self.stream.getvalue()
-        source = compile(code, "", "exec")
+    @property
+    def bytes_code(self):
+        """compiled code object defining output_bytes(), the variant yielding encoded pieces"""
+        if self._bytes_code is None:
+            self._build("_bytes_code", lambda: self.compile(encoding=self.encoding))
+        return self._bytes_code
 
-        globals_ = kwargs
-        locals_ = {}
-        exec(source, globals_, locals_)
-        return ''.join(locals_['output']())
+    @property
+    def render_func(self):
+        """output(context) defined by the compiled code"""
+        if self._render_func is None:
+            self._build("_render_func", lambda: self._load_output(self.code, "output"))
+        return self._render_func
 
-    def tokenize(self, content):
-        text = ""
-        tokens = []
-        pos = 0
-        inner_block = False
+    @property
+    def async_render_func(self):
+        if self._async_render_func is None:
+            self._build("_async_render_func", lambda: self._load_output(self.async_code, "output_async"))
+        return self._async_render_func
+
+    @property
+    def bytes_render_func(self):
+        if self._bytes_render_func is None:
+            self._build("_bytes_render_func", lambda: self._load_output(self.bytes_code, "output_bytes"))
+        return self._bytes_render_func
 
-        def skip_whitespace(pos):
+    @property
+    def dependencies(self):
+        """{path: sha1 of the source} of the templates included or extended by this one"""
+        if self._dependencies is None:
+            self._build("_dependencies", self._load_dependencies)
+        return self._dependencies
+
+    def _load_dependencies(self):
+        if self._code is None:
+            # parse() records them
+            self._code = self.compile()
+            return self._dependencies
+        namespace = {}
+        exec(self._code, namespace)
+        return namespace.get("dependencies", {})
+
+    def referenced_names(self):
+        """
+        names of the context values the template reads, in any branch,
+        including those read by included templates; loop variables and the
+        loop helper are not counted
+        """
+        if self._referenced_names is None:
+            self._build("_referenced_names", self._find_referenced_names)
+        return self._referenced_names
+
+    def _find_referenced_names(self):
+        with self._open_source() as source:
+            nodes = self.parse(self.tokenize(source))
+        if self.optimized:
+            from .optimizer import optimize
+            nodes = optimize(nodes)
+        return frozenset(find_names(nodes))
+
+    def _release_source(self, stat):
+        """
+        compile output() and drop the mapped source; `stat` is the
+        (mtime, size) of the file, the other variants map it again
+        """
+        with self._lock:
+            if self._code is None:
+                self._code = self.compile()
+            self._mapped_stat = stat
+            self.source = None
+
+    @contextmanager
+    def _open_source(self):
+        """the source, mapped again from the file if it was released"""
+        if self._mapped_stat is None:
+            yield self.source
+            return
+        with open(self.name, "rb") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_mtime_ns, st.st_size) != self._mapped_stat:
+                raise RuntimeError(f"'{self.name}' changed since it was loaded")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                yield source
+
+    def _load_output(self, code, name):
+        namespace = {"fragment_cache": self.fragment_cache}
+        exec(code, namespace)
+        return namespace[name]
+
+    def compile(self, is_async=False, timings=None, encoding=None):
+        """
+        compile the template to a code object; when `timings` is a dict the
+        seconds spent in each phase are stored in it
+        """
+        source = self.compile_source(is_async, timings, encoding)
+        start = time.perf_counter()
+        code = compile(source, "<template>", "exec")
+        if timings is not None:
+            timings["compile"] = time.perf_counter() - start
+        return code
+
+    def compile_source(self, is_async=False, timings=None, encoding=None):
+        """
+        python source of the module defining output(context), or
+        output_bytes(context) yielding bytes in `encoding`
+        """
+        clock = time.perf_counter
+        with self._open_source() as source:
+            t0 = clock()
+            tokens = self.tokenize(source)
+            t1 = clock()
+            with self._lock:
+                # codegen() writes the dependencies found by this parse
+                nodes = self.parse(tokens)
+                t2 = clock()
+                source = self.codegen(nodes, is_async, encoding)
+        if timings is not None:
+            timings.update(tokenize=t1 - t0, parse=t2 - t1, codegen=clock() - t2)
+        return source
+
+    def module_source(self):
+        """source of an importable module defining output(), output_async() and output_bytes()"""
+        with self._lock, self._open_source() as source:
+            nodes = self.parse(self.tokenize(source))
+            return (
+                f"# generated by jingu from {self.name!r}, do not edit\n"
+                # replaced by Template.from_module()
+                + "fragment_cache = None\n"
+                + f"compile_options = {self.compile_options()!r}\n"
+                + f"referenced_names = {tuple(sorted(self.referenced_names()))!r}\n"
+                + self.codegen(nodes)
+                + self.codegen(nodes, is_async=True)
+                + self.codegen(nodes, encoding=self.encoding)
+            )
+
+    def codegen(self, nodes, is_async=False, encoding=None):
+        if self.optimized:
+            from .optimizer import optimize
+            nodes = optimize(nodes)
+        if self.minify:
+            from .optimizer import collapse_whitespace
+            collapse_whitespace(nodes)
+
+        if is_async:
+            # awaitables read on every render are awaited once on entry,
+            # the others where they are first read, see Frame.load()
+            bound = find_required_names(nodes)
+        else:
+            # only names read on every render are bound on entry, a name
+            # read in a branch that isn't taken must not raise KeyError
+            uses = Counter(name for n in nodes for name in n.find_names())
+            bound = [name for name in find_required_names(nodes) if uses[name] > 1]
+        frame = Frame(is_async, bound=bound, autoescape=self.autoescape, encoding=encoding)
+
+        stream = StringIO()
+        stream.write(visit_nodes(nodes, frame))
+        for name, key, attribute in frame.getters:
+            stream.write(f"{name} = getter({key!r}, {attribute})\n")
+        if self._dependencies:
+            stream.write(f"dependencies = {self._dependencies!r}\n")
+
+        return stream.getvalue()
+
+    def generate(self, *args, **kwargs):
+        """yield the output piece by piece instead of joining it"""
+        if self._observers:
+            phases = {}
+            func, cache_hit = self._observed_func("_code", "render_func", phases)
+            return self._observed(func(dict(*args, **kwargs)), phases, cache_hit)
+        func = self._render_func or self.render_func
+        return func(dict(*args, **kwargs))
+
+    def generate_bytes(self, *args, **kwargs):
+        """
+        like generate() but yield bytes in `encoding`; long static text is
+        encoded once when the template is compiled, the values and the
+        short text between them are encoded together on each render
+        """
+        if self._observers:
+            phases = {}
+            func, cache_hit = self._observed_func("_bytes_code", "bytes_render_func", phases, encoding=self.encoding)
+            return self._observed(func(dict(*args, **kwargs)), phases, cache_hit)
+        func = self._bytes_render_func or self.bytes_render_func
+        return func(dict(*args, **kwargs))
+
+    def render_bytes(self, *args, **kwargs):
+        """
+        the output as a list of bytes pieces, to be passed as is to
+        socket.sendmsg() or file.writelines() without joining them first
+        """
+        return list(self.generate_bytes(*args, **kwargs))
+
+    def stream(self, *args, **kwargs):
+        return TemplateStream(self.generate(*args, **kwargs))
+
+    def render(self, *args, **kwargs):
+        if self._observers:
+            return self._render_observed(dict(*args, **kwargs))
+        func = self._render_func or self.render_func
+        return ''.join(func(dict(*args, **kwargs)))
+
+    def render_many(self, contexts, workers=None, chunksize=64):
+        """
+        Render the template once per context in `contexts` and return a lazy
+        iterator over the outputs, in the order of `contexts`.
+
+        workers: None or 1 renders in this process. With more workers the
+        compiled code is sent once to each process of a pool, and the
+        contexts, which have to be picklable, are sent in chunks of
+        `chunksize`. At most a few chunks per worker are in flight, so
+        `contexts` may be an arbitrarily long generator. Observers get an
+        event per context, except from the workers of a pool.
+        """
+        if workers is None or workers <= 1 or self.source is None and self._code is None:
+            return self._render_many(contexts)
+        return self._render_many_parallel(contexts, workers, chunksize)
+
+    def _render_many(self, contexts):
+        if self._observers:
+            for context in contexts:
+                yield self._render_observed(dict(context))
+            return
+        func = self._render_func or self.render_func
+        for context in contexts:
+            yield ''.join(func(dict(context)))
+
+    def _render_many_parallel(self, contexts, workers, chunksize):
+        contexts = iter(contexts)
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_render_worker, initargs=(marshal.dumps(self.code),)
+        )
+        pending = deque()
+        try:
             while True:
-                if content[pos] == " ":
-                    pos += 1
-                    continue
-                else:
+                while len(pending) < workers * 2:
+                    chunk = list(islice(contexts, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(_render_chunk, chunk))
+                if not pending:
                     break
-            return pos
+                yield from pending.popleft().result()
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def _render_observed(self, context):
+        phases = {}
+        cache_hit = self._code is not None or self._render_func is not None
+        if not cache_hit:
+            self._build("_code", lambda: self.compile(timings=phases))
+
+        func = self.render_func
+        start = time.perf_counter()
+        output = ''.join(func(context))
+        phases["render"] = time.perf_counter() - start
+
+        self.environment.notify(TemplateEvent("render", self.name, phases, len(output), cache_hit))
+        return output
+
+    def _observed_func(self, code, func, phases, **options):
+        """
+        (output function, cache_hit) for an observed render, the function's
+        property is `func` and its code attribute `code`, compiled with
+        `options` and timings in `phases` when it is missing
+        """
+        cache_hit = getattr(self, code) is not None or getattr(self, "_" + func) is not None
+        if not cache_hit:
+            self._build(code, lambda: self.compile(timings=phases, **options))
+        return getattr(self, func), cache_hit
+
+    def _observed(self, pieces, phases, cache_hit):
+        """
+        pass the pieces through and send the render event once all are
+        produced; the time includes the consumer's, between the pieces
+        """
+        size = 0
+        start = time.perf_counter()
+        for piece in pieces:
+            size += len(piece)
+            yield piece
+        phases["render"] = time.perf_counter() - start
+        self.environment.notify(TemplateEvent("render", self.name, phases, size, cache_hit))
+
+    async def _observed_async(self, pieces, phases, cache_hit):
+        size = 0
+        start = time.perf_counter()
+        async for piece in pieces:
+            size += len(piece)
+            yield piece
+        phases["render"] = time.perf_counter() - start
+        self.environment.notify(TemplateEvent("render", self.name, phases, size, cache_hit))
+
+    async def generate_async(self, *args, **kwargs):
+        """
+        Async variant of generate(). Awaitables in the context are awaited and
+        control is handed back to the event loop every `async_yield_every`
+        pieces, so a large render doesn't starve other tasks.
+        """
+        if self._observers:
+            phases = {}
+            func, cache_hit = self._observed_func("_async_code", "async_render_func", phases, is_async=True)
+            pieces = self._observed_async(func(dict(*args, **kwargs)), phases, cache_hit)
+        else:
+            pieces = self.async_render_func(dict(*args, **kwargs))
+        n = 0
+        every = self.async_yield_every
+        async for chunk in pieces:
+            yield chunk
+            n += 1
+            if n == every:
+                n = 0
+                await asyncio.sleep(0)
+
+    async def render_async(self, *args, **kwargs):
+        return ''.join([chunk async for chunk in self.generate_async(*args, **kwargs)])
+
+    def render_to(self, fp, *args, **kwargs):
+        """
+        write the output to a file object without building it in memory; it
+        is encoded in `encoding` for binary files, see _is_binary()
+        """
+        encoding = self.encoding if _is_binary(fp) else None
+        self.stream(*args, **kwargs).dump(fp, encoding=encoding, buffer_size=self.write_buffer_size)
 
-        # tokenize
-        while True:
-            m = self.VARIABLE_BEGIN_PATTERN.match(content, pos) or self.BLOCK_BEGIN_PATTERN.match(content, pos)
-            if m:
-                # flush text
-                if len(text) > 0:
-                    tokens.append(Token(TokenType.DATA, text))
-                    text = ""
-
-                # variable block
-                if m.re is self.VARIABLE_BEGIN_PATTERN:
-                    g = m.group()
-                    tokens.append(Token(TokenType.VARIABLE_BEGIN, g))
-                    pos = m.end()
-
-                    pos = skip_whitespace(pos)
-
-                    name_or_int_m = self.NAME_PATTERN.match(content, pos) or self.INTEGER_PATTERN.match(content, pos)
-                    if name_or_int_m is None:
-                        raise SyntaxError()
-
-                    if name_or_int_m.re is self.INTEGER_PATTERN:
-                        tokens.append(Token(TokenType.INTEGER, name_or_int_m.group()))
-                        pos = name_or_int_m.end()
-                    elif name_or_int_m.re is self.NAME_PATTERN:
-                        tokens.append(Token(TokenType.NAME, name_or_int_m.group()))
-                        pos = name_or_int_m.end()
-                    else:
-                        raise SyntaxError()
-
-                    if name_or_int_m.re is self.NAME_PATTERN:
-                        lbracket_or_dot_m = self.LBRACKET_PATTERN.match(content, pos) or self.DOT_PATTERN.match(content, pos)
-                        if lbracket_or_dot_m:
-                            if lbracket_or_dot_m.re is self.LBRACKET_PATTERN:
-                                lbracket_m = lbracket_or_dot_m
-                                tokens.append(Token(TokenType.LBRACKET, lbracket_m.group()))
-                                pos = lbracket_m.end()
-
-                                int_or_str_m = self.INTEGER_PATTERN.match(content, pos) or self.STRING_PATTERN.match(content, pos)
-                                if int_or_str_m is None:
-                                    raise SyntaxError()
-
-                                if int_or_str_m.re is self.INTEGER_PATTERN:
-                                    tokens.append(Token(TokenType.INTEGER, int_or_str_m.group()))
-                                elif int_or_str_m.re is self.STRING_PATTERN:
-                                    if int_or_str_m.group().startswith("'"):
-                                        s = int_or_str_m.group().strip("'")
-                                    elif int_or_str_m.group().startswith('"'):
-                                        s = int_or_str_m.group().strip('"')
-                                    tokens.append(Token(TokenType.STRING, s))
-                                else:
-                                    raise SyntaxError()
-
-                                pos = int_or_str_m.end()
-
-                                rbracket_m = self.RBRACKET_PATTERN.match(content, pos)
-                                if rbracket_m is None:
-                                    raise SyntaxError()
-                                tokens.append(Token(TokenType.RBRACKET, rbracket_m.group()))
-                                pos = rbracket_m.end()
-
-                            elif lbracket_or_dot_m.re is self.DOT_PATTERN:
-                                dot_m = lbracket_or_dot_m
-                                if dot_m is None:
-                                    raise SyntaxError()
-                                tokens.append(Token(TokenType.DOT, dot_m.group()))
-                                pos = dot_m.end()
-
-                                str_m = self.NAME_PATTERN.match(content, pos)
-                                if str_m is None:
-                                    raise SyntaxError()
-                                tokens.append(Token(TokenType.NAME, str_m.group()))
-                                pos = str_m.end()
-
-                    pos = skip_whitespace(pos)
-
-                    # calculate
-                    while True:
-                        op_m = self._match_operators(content, pos)
-                        if op_m is None:
-                            break
-
-                        if op_m.re is self.ADD_PATTERN:
-                            tokens.append(Token(TokenType.ADD, op_m.group()))
-                        if op_m.re is self.SUB_PATTERN:
-                            tokens.append(Token(TokenType.SUB, op_m.group()))
-                        if op_m.re is self.MUL_PATTERN:
-                            tokens.append(Token(TokenType.MUL, op_m.group()))
-                        if op_m.re is self.DIV_PATTERN:
-                            tokens.append(Token(TokenType.DIV, op_m.group()))
-                        if op_m.re is self.MOD_PATTERN:
-                            tokens.append(Token(TokenType.MOD, op_m.group()))
-                        pos = op_m.end()
-
-                        pos = skip_whitespace(pos)
-
-                        name_or_int_m = self.NAME_PATTERN.match(content, pos) or self.INTEGER_PATTERN.match(content, pos)
-                        if name_or_int_m is None:
-                            raise SyntaxError()
-
-                        if name_or_int_m.re is self.INTEGER_PATTERN:
-                            tokens.append(Token(TokenType.INTEGER, name_or_int_m.group()))
-                            pos = name_or_int_m.end()
-                        elif name_or_int_m.re is self.NAME_PATTERN:
-                            tokens.append(Token(TokenType.NAME, name_or_int_m.group()))
-                            pos = name_or_int_m.end()
-
-                        if name_or_int_m.re is self.NAME_PATTERN:
-                            lbracket_or_dot_m = self.LBRACKET_PATTERN.match(content, pos) or self.DOT_PATTERN.match(content, pos)
-                            if lbracket_or_dot_m:
-                                if lbracket_or_dot_m.re is self.LBRACKET_PATTERN:
-                                    lbracket_m = lbracket_or_dot_m
-                                    tokens.append(Token(TokenType.LBRACKET, lbracket_m.group()))
-                                    pos = lbracket_m.end()
-
-                                    int_or_str_m = self.INTEGER_PATTERN.match(content, pos) or self.STRING_PATTERN.match(content, pos)
-                                    if int_or_str_m is None:
-                                        raise SyntaxError()
-
-                                    if int_or_str_m.re is self.INTEGER_PATTERN:
-                                        tokens.append(Token(TokenType.INTEGER, int_or_str_m.group()))
-                                    elif int_or_str_m.re is self.STRING_PATTERN:
-                                        if int_or_str_m.group().startswith("'"):
-                                            s = int_or_str_m.group().strip("'")
-                                        elif int_or_str_m.group().startswith('"'):
-                                            s = int_or_str_m.group().strip('"')
-                                        tokens.append(Token(TokenType.STRING, s))
-                                    else:
-                                        raise SyntaxError()
-
-                                    pos = int_or_str_m.end()
-
-                                    rbracket_m = self.RBRACKET_PATTERN.match(content, pos)
-                                    if rbracket_m is None:
-                                        raise SyntaxError()
-                                    tokens.append(Token(TokenType.RBRACKET, rbracket_m.group()))
-                                    pos = rbracket_m.end()
-
-                                elif lbracket_or_dot_m.re is self.DOT_PATTERN:
-                                    dot_m = lbracket_or_dot_m
-                                    if dot_m is None:
-                                        raise SyntaxError()
-                                    tokens.append(Token(TokenType.DOT, dot_m.group()))
-                                    pos = dot_m.end()
-
-                                    str_m = self.NAME_PATTERN.match(content, pos)
-                                    if str_m is None:
-                                        raise SyntaxError()
-                                    tokens.append(Token(TokenType.NAME, str_m.group()))
-                                    pos = str_m.end()
-                        pos = skip_whitespace(pos)
-
-                    pos = skip_whitespace(pos)
-
-                    mmm = self.VARIABLE_END_PATTERN.match(content, pos)
-                    if mmm is None:
-                        raise SyntaxError()
-
-                    g = mmm.group()
-                    tokens.append(Token(TokenType.VARIABLE_END, g))
-                    pos = mmm.end()
-
-                    if pos >= len(content):
-                        break
+    def tokenize(self, content):
+        return Lexer(self.trim_blocks, self.lstrip_blocks).tokenize(content)
 
-                    continue
+    def load_source(self, path):
+        """source of an included or extended template"""
+        with open(path, "r") as f:
+            return f.read()
 
-                if m.re is self.BLOCK_BEGIN_PATTERN:
-                    g = m.group()
-                    tokens.append(Token(TokenType.BLOCK_BEGIN, g))
-                    pos = m.end()
-
-                    pos = skip_whitespace(pos)
-
-                    if not inner_block:
-                        name_m = self.NAME_PATTERN.match(content, pos)
-                        if name_m is None:
-                            raise SyntaxError()
-                        g = name_m.group()
-                        tokens.append(Token(TokenType.NAME, g))
-                        pos = name_m.end()
-
-                        pos = skip_whitespace(pos)
-
-                        name_or_int_m = self.NAME_PATTERN.match(content, pos) or self.INTEGER_PATTERN.match(content, pos)
-                        if name_or_int_m is None:
-                            raise SyntaxError()
-
-                        if name_or_int_m.re is self.INTEGER_PATTERN:
-                            tokens.append(Token(TokenType.INTEGER, name_or_int_m.group()))
-                            pos = name_or_int_m.end()
-                        elif name_or_int_m.re is self.NAME_PATTERN:
-                            tokens.append(Token(TokenType.NAME, name_or_int_m.group()))
-                            pos = name_or_int_m.end()
-                        else:
-                            raise SyntaxError()
-                    else:
-                        name_m = self.NAME_PATTERN.match(content, pos)
-                        if name_m is None:
-                            raise SyntaxError()
-                        g = name_m.group()
-                        tokens.append(Token(TokenType.NAME, g))
-                        pos = name_m.end()
-
-                        pos = skip_whitespace(pos)
-
-                    inner_block = not inner_block
-
-                    pos = skip_whitespace(pos)
-
-                    mmm = self.BLOCK_END_PATTERN.match(content, pos)
-                    if mmm is None:
-                        raise SyntaxError()
-
-                    g = mmm.group()
-                    tokens.append(Token(TokenType.BLOCK_END, g))
-                    pos = mmm.end()
-
-                    if pos >= len(content):
-                        break
+    def parse(self, tokens):
+        if not isinstance(tokens, TokenStream):
+            tokens = TokenStream.from_tokens(tokens)
+        with self._lock:
+            # templates being parsed, include paths are relative to the last one
+            self._parsing = [os.path.normpath(self.name)] if self.name else []
+            self._parsed_dependencies = {}
+            nodes = flatten_blocks(self._parse_template(tokens))
+            # replaced as a whole, readers never see a partial dict
+            self._dependencies = self._parsed_dependencies
+        return [RootNode()] + nodes
+
+    def _parse_template(self, tokens):
+        """nodes of a whole template with {% extends %} resolved and blocks kept"""
+        nodes, i = self._parse_body(tokens, 0)
+        for n in nodes:
+            if isinstance(n, ExtendsNode):
+                blocks = {}
+                for block in find_blocks(nodes):
+                    if block.name in blocks:
+                        raise ParseError(f"block '{block.name}' defined twice")
+                    blocks[block.name] = block
+                return replace_blocks(self._load_nodes(n.name), blocks)
+        return nodes
 
+    def _load_nodes(self, name):
+        """parse the template `name`, relative to the template being parsed"""
+        base = os.path.dirname(self._parsing[-1]) if self._parsing else ""
+        path = os.path.normpath(os.path.join(base, name))
+        if path in self._parsing:
+            raise ParseError(f"'{path}' includes or extends itself")
+        try:
+            source = self.load_source(path)
+        except OSError as e:
+            raise ParseError(f"template '{path}' not found") from e
+        self._parsed_dependencies[path] = _hash_source(source)
+
+        self._parsing.append(path)
+        try:
+            return self._parse_template(self.tokenize(source))
+        finally:
+            self._parsing.pop()
+
+    def _parse_body(self, tokens, i, end=()):
+        """parse nodes until one of the block tags in `end`, return (nodes, index of its BLOCK_BEGIN)"""
+        nodes = []
+        while i < len(tokens):
+            type = tokens.types[i]
+            if type == TokenType.DATA:
+                nodes.append(DataNode(tokens.value(i)))
+                i += 1
+            elif type == TokenType.VARIABLE_BEGIN:
+                i = self._parse_variable(tokens, i, nodes)
+            elif type == TokenType.BLOCK_BEGIN:
+                name = tokens.value(i + 1)
+                if name in end:
+                    return nodes, i
+                elif name == "if":
+                    node, i = self._parse_if(tokens, i + 2)
+                elif name == "for":
+                    node, i = self._parse_for(tokens, i + 2)
+                elif name == "cache":
+                    node, i = self._parse_cache(tokens, i + 2)
+                elif name == "block":
+                    node, i = self._parse_block(tokens, i + 2)
+                elif name == "include":
+                    included, i = self._parse_include(tokens, i + 2)
+                    nodes.extend(included)
                     continue
+                elif name == "extends":
+                    if end:
+                        raise ParseError("'extends' has to be at the top level")
+                    node, i = self._parse_extends(tokens, i + 2)
+                else:
+                    raise ParseError(f"unknown tag '{name}'")
+                nodes.append(node)
+            else:
+                raise ParseError(f"unexpected token {tokens[i]}")
+
+        if end:
+            raise ParseError(f"missing '{end[0]}'")
+        return nodes, i
+
+    def _parse_variable(self, tokens, i, nodes):
+        nodes.append(SkipNode(tokens.value(i)))
+
+        operand, i = self._parse_operand(tokens, i + 1)
+        nodes.append(operand)
+
+        while tokens.types[i] in CalcNode.OPERATORS:
+            op = tokens.value(i)
+            right, i = self._parse_operand(tokens, i + 1)
+            nodes.append(CalcNode(op, nodes.pop(), right))
+
+        if tokens.types[i] != TokenType.VARIABLE_END:
+            raise ParseError()
+        nodes.append(SkipNode(tokens.value(i)))
+        return i + 1
+
+    def _parse_block_end(self, tokens, i):
+        if tokens.types[i] != TokenType.BLOCK_END:
+            raise ParseError(f"expected '%}}', got {tokens[i]}")
+        return i + 1
+
+    def _parse_end_tag(self, tokens, i):
+        """skip the {% end... %} tag whose BLOCK_BEGIN is tokens[i]"""
+        return self._parse_block_end(tokens, i + 2)
+
+    def _parse_if(self, tokens, i):
+        test, i = self._parse_operand(tokens, i)
+        i = self._parse_block_end(tokens, i)
+        body, i = self._parse_body(tokens, i, ("endif",))
+        return IfNode(test, body), self._parse_end_tag(tokens, i)
+
+    def _parse_for(self, tokens, i):
+        if tokens.types[i] != TokenType.NAME or tokens.types[i + 1] != TokenType.NAME or tokens.value(i + 1) != "in":
+            raise ParseError("expected '{% for <name> in <expression> %}'")
+        target = tokens.value(i)
+
+        iter, i = self._parse_operand(tokens, i + 2)
+        i = self._parse_block_end(tokens, i)
+        body, i = self._parse_body(tokens, i, ("endfor",))
+        return ForNode(target, iter, body), self._parse_end_tag(tokens, i)
+
+    def _parse_name_argument(self, tokens, i, tag):
+        """the string literal argument of {% include %} and {% extends %}"""
+        if tokens.types[i] != TokenType.STRING:
+            raise ParseError(f"expected '{{% {tag} \"<template>\" %}}'")
+        return tokens.value(i), self._parse_block_end(tokens, i + 1)
+
+    def _parse_include(self, tokens, i):
+        name, i = self._parse_name_argument(tokens, i, "include")
+        # blocks of an included template can't be overridden
+        return flatten_blocks(self._load_nodes(name)), i
+
+    def _parse_extends(self, tokens, i):
+        name, i = self._parse_name_argument(tokens, i, "extends")
+        return ExtendsNode(name), i
+
+    def _parse_block(self, tokens, i):
+        if tokens.types[i] != TokenType.NAME:
+            raise ParseError("expected '{% block <name> %}'")
+        name = tokens.value(i)
+        i = self._parse_block_end(tokens, i + 1)
+        body, i = self._parse_body(tokens, i, ("endblock",))
+
+        # {% endblock %} or {% endblock <name> %}
+        i += 2
+        if tokens.types[i] == TokenType.NAME:
+            if tokens.value(i) != name:
+                raise ParseError(f"'endblock {tokens.value(i)}' closes block '{name}'")
+            i += 1
+        return BlockNode(name, body), self._parse_block_end(tokens, i)
+
+    def _parse_cache(self, tokens, i):
+        """{% cache <key>... [<ttl>] %}, a trailing integer is the ttl in seconds"""
+        keys = []
+        ttl = None
+        while tokens.types[i] != TokenType.BLOCK_END:
+            type = tokens.types[i]
+            if type == TokenType.INTEGER and tokens.types[i + 1] == TokenType.BLOCK_END:
+                ttl = int(tokens.value(i))
+                i += 1
+            elif type == TokenType.STRING:
+                keys.append(tokens.value(i))
+                i += 1
+            else:
+                key, i = self._parse_operand(tokens, i)
+                keys.append(key)
+        body, i = self._parse_body(tokens, i + 1, ("endcache",))
+        return CacheNode(keys, ttl, body), self._parse_end_tag(tokens, i)
+
+    def _parse_operand(self, tokens, i):
+        """parse an INTEGER or a NAME followed by any number of [INDEX] and .ATTR starting at tokens[i]"""
+        type = tokens.types[i]
+        if type == TokenType.INTEGER:
+            return ConstNode(tokens.value(i)), i + 1
+        if type != TokenType.NAME:
+            raise ParseError()
+
+        node = NameNode(tokens.value(i))
+        i += 1
+        while True:
+            type = tokens.types[i]
+            if type == TokenType.LBRACKET:
+                index_type = tokens.types[i + 1]
+                if index_type == TokenType.INTEGER:
+                    index = int(tokens.value(i + 1))
+                elif index_type == TokenType.STRING:
+                    index = tokens.value(i + 1)
+                else:
+                    raise ParseError()
+                if tokens.types[i + 2] != TokenType.RBRACKET:
+                    raise ParseError()
+                node = GetNode(node, index)
+                i += 3
+            elif type == TokenType.DOT:
+                if tokens.types[i + 1] != TokenType.NAME:
+                    raise ParseError()
+                node = GetNode(node, tokens.value(i + 1), attribute=True)
+                i += 2
+            else:
+                return node, i
+
+
+class TemplateStream(object):
+    """
+    Iterator over the output of a template.
+
+    By default every piece produced by the template is passed through as is.
+    enable_buffering() groups small pieces into chunks of at least `size`
+    characters so that WSGI/ASGI servers don't send tiny writes.
+    """
+
+    def __init__(self, gen):
+        self._gen = gen
+        self.disable_buffering()
+
+    def disable_buffering(self):
+        self._iter = self._gen
+        self.buffered = False
+
+    def enable_buffering(self, size=8192):
+        if size <= 0:
+            raise ValueError("buffer size too small")
+        self._iter = self._buffered_generator(size)
+        self.buffered = True
+        return self
+
+    def _buffered_generator(self, size):
+        buf = []
+        buffered = 0
+        for chunk in self._gen:
+            buf.append(chunk)
+            buffered += len(chunk)
+            if buffered >= size:
+                yield ''.join(buf)
+                buf = []
+                buffered = 0
+        if buf:
+            yield ''.join(buf)
+
+    def dump(self, fp, encoding=None, buffer_size=65536):
+        """
+        Write the remaining output to `fp`, batching pieces into writes of at
+        least `buffer_size` characters. If `encoding` is given the chunks are
+        encoded before they are written, for files opened in binary mode.
+        """
+        if not self.buffered:
+            self.enable_buffering(buffer_size)
+
+        write = fp.write
+        if encoding is None:
+            for chunk in self._iter:
+                write(chunk)
+        else:
+            for chunk in self._iter:
+                write(chunk.encode(encoding))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iter)
+
+
+class Frame(object):
+    """
+    code generation state passed to Node.visit()
+
+    `bound` holds the context names that output() copies into fast locals
+    on entry, other names are read from the context where they are used,
+    and awaited there the first time by the async variant.
+    `locals` maps names assigned inside the template (loop targets) to the
+    python identifiers holding them and `loop` describes the innermost loop.
+    With `autoescape` expressions that may produce HTML are escaped.
+    With an `encoding` output() yields bytes, see visit_nodes().
+    `getters` collects the (identifier, key, attribute) of every lookup
+    site, each gets its own runtime.getter() defined after output().
+    """
+
+    CONSTANTS = ("True", "False", "None")
+    # see visit_nodes()
+    ENCODED_TEXT_SIZE = 256
+
+    def __init__(self, is_async=False, indent=1, bound=(), autoescape=False, encoding=None):
+        self.is_async = is_async
+        self.indent = indent
+        self.bound = bound
+        self.autoescape = autoescape
+        self.encoding = encoding
+        # of the getters' identifiers, each variant of output() has its own
+        self.prefix = "async_" if is_async else "bytes_" if encoding else ""
+        self.locals = {}
+        self.loop = None
+        self.getters = []
+
+    def inner(self):
+        frame = Frame(self.is_async, self.indent + 1, self.bound, self.autoescape, self.encoding)
+        frame.locals = dict(self.locals)
+        frame.loop = self.loop
+        frame.getters = self.getters
+        frame.prefix = self.prefix
+        return frame
+
+    def getter(self, key, attribute):
+        """identifier of a new lookup site for `key`"""
+        name = f"{self.prefix}get_{len(self.getters)}"
+        self.getters.append((name, key, attribute))
+        return name
+
+    def line(self, code):
+        return "    " * self.indent + code + "\n"
+
+    def output(self, value):
+        """line yielding the str expression `value`"""
+        if self.encoding:
+            return self.line(f"yield {value}.encode({self.encoding!r})")
+        return self.line(f"yield {value}")
+
+    def load(self, name):
+        if name in self.CONSTANTS:
+            return name
+        if name in self.locals:
+            return self.locals[name]
+        if name in self.bound:
+            return f"l_{name}"
+        if self.is_async:
+            return f"(await await_name(context, {name!r}))"
+        return f"context[{name!r}]"
 
-            text += content[pos]
-            pos += 1
 
-            if pos >= len(content):
-                if len(text) > 0:
-                    tokens.append(Token(TokenType.DATA, text))
-                break
+class Node(object):
+    code = ""
 
-        return tokens
+    def find_names(self):
+        """names this node reads from the context, once per use"""
+        return ()
 
-    def parse(self, tokens):
-        nodes = [RootNode()]
+    def required_names(self):
+        """names read whenever the node runs, not only in a branch or a loop body"""
+        return self.find_names()
 
-        i = 0
-        while True:
-            t = tokens[i]
-            if t.type == TokenType.DATA:
-                nodes.append(DataNode(t.value))
-            elif t.type == TokenType.VARIABLE_BEGIN:
-                nodes.append(SkipNode(t.value))
-                i += 1
+    def iter_child_nodes(self):
+        return ()
 
-                while True:
-                    t = tokens[i]
-
-                    if t.type == TokenType.NAME:
-                        j = i + 1
-                        if tokens[j].type == TokenType.LBRACKET:
-                            j += 1
-                            next_t = tokens[j]
-                            if next_t.type not in (TokenType.INTEGER, TokenType.STRING):
-                                raise ParseError()
-                            index = next_t.value
-
-                            j += 1
-                            next_t = tokens[j]
-                            if next_t.type != TokenType.RBRACKET:
-                                raise ParseError()
-                            nodes.append(GetNode(t.value, index))
-                            j += 1
-
-                            i = j
-                        elif tokens[j].type == TokenType.DOT:
-                            j += 1
-                            next_t = tokens[j]
-                            if next_t.type != TokenType.NAME:
-                                raise ParseError()
-                            index = next_t.value
-                            nodes.append(GetNode(t.value, index))
-                            j += 1
-
-                            i = j
-                        else:
-                            nodes.append(NameNode(t.value))
-                            i += 1
-                    elif t.type == TokenType.INTEGER:
-                        nodes.append(ConstNode(t.value))
-                        i += 1
-
-                    t = tokens[i]
-
-                    if t.type in [TokenType.ADD, TokenType.SUB, TokenType.MUL, TokenType.DIV, TokenType.MOD]:
-                        left = nodes.pop()
-                        op = t.value
-
-                        right = None
-                        i = i + 1
-                        t = tokens[i]
-                        if t.type == TokenType.NAME:
-                            j = i + 1
-                            if tokens[j].type == TokenType.LBRACKET:
-                                j += 1
-                                next_t = tokens[j]
-                                if next_t.type not in (TokenType.INTEGER, TokenType.STRING):
-                                    raise ParseError()
-                                index = next_t.value
-
-                                j += 1
-                                next_t = tokens[j]
-                                if next_t.type != TokenType.RBRACKET:
-                                    raise ParseError()
-                                right = GetNode(t.value, index)
-                                j += 1
-
-                                i = j
-                            elif tokens[j].type == TokenType.DOT:
-                                j += 1
-                                next_t = tokens[j]
-                                if next_t.type != TokenType.NAME:
-                                    raise ParseError()
-                                index = next_t.value
-                                right = GetNode(t.value, index)
-                                j += 1
-
-                                i = j
-                            else:
-                                right = NameNode(t.value)
-                                i += 1
-                        elif t.type == TokenType.INTEGER:
-                            right = ConstNode(t.value)
-                            i += 1
-
-                        nodes.append(CalcNode(op, left, right))
-
-                    t = tokens[i]
-                    if t.type == TokenType.VARIABLE_END:
-                        nodes.append(SkipNode(t.value))
-                        break
+    def is_safe(self, frame):
+        """whether the value of the expression can't contain HTML"""
+        return False
 
-            elif t.type == TokenType.BLOCK_BEGIN:
-                i += 1
-                t = tokens[i]
-                if t.type == TokenType.NAME and t.value == "if":
-                    i += 1
-                    if tokens[i].type == TokenType.NAME:
-                        test = tokens[i].value
-
-                    i += 1
-                    if tokens[i].type == TokenType.BLOCK_END:
-                        if_node = IfNode(test)
-
-                    i += 1
-                    if tokens[i].type == TokenType.DATA:
-                        data = DataNode(tokens[i].value)
-
-                    i += 1
-                    if tokens[i].type == TokenType.BLOCK_BEGIN:
-                        i += 1
-                        if tokens[i].type == TokenType.NAME and tokens[i].value == "endif":
-                            i += 1
-                            if tokens[i].type == TokenType.BLOCK_END:
-                                if_node.body = data
-                                nodes.append(if_node)
+    def is_numeric(self, frame):
+        """whether the expression is known to produce a number"""
+        return False
 
-            i += 1
-            if i >= len(tokens):
-                break
 
-        return nodes
+def visit_expr(node, frame):
+    """yield the value of an expression node"""
+    return frame.output(value_expr(node, frame))
 
 
-class Node(object):
-    code = ""
+def value_expr(node, frame):
+    """the str value of an expression node, escaped unless it is known to be safe"""
+    if frame.autoescape and not node.is_safe(frame):
+        return f"escape_str({node.expr(frame)})"
+    return f"str({node.expr(frame)})"
+
+
+def visit_nodes(nodes, frame):
+    """
+    code of a sequence of nodes. The bytes variant joins each run of values
+    and the static text between them and encodes it with one encode() call,
+    only static text of at least Frame.ENCODED_TEXT_SIZE characters is
+    yielded as a constant encoded at compile time.
+    """
+    if not frame.encoding:
+        return "".join(n.visit(frame) for n in nodes)
+
+    code = []
+    run = []
+    for n in nodes:
+        if isinstance(n, DataNode) and len(n.value) < frame.ENCODED_TEXT_SIZE:
+            run.append(n)
+        elif isinstance(n, (NameNode, GetNode, ConstNode, CalcNode)):
+            run.append(n)
+        else:
+            code.append(visit_run(run, frame))
+            code.append(n.visit(frame))
+            run = []
+    code.append(visit_run(run, frame))
+    return "".join(code)
+
+
+def visit_run(run, frame):
+    if all(isinstance(n, DataNode) for n in run):
+        return DataNode("".join(n.value for n in run)).visit(frame) if run else ""
+    if len(run) == 1:
+        return run[0].visit(frame)
+    pieces = [repr(n.value) if isinstance(n, DataNode) else value_expr(n, frame) for n in run]
+    return frame.output(f"''.join(({', '.join(pieces)}))")
+
+
+def find_names(nodes):
+    """context names read by the nodes, in order of first use"""
+    names = {}
+    for n in nodes:
+        for name in n.find_names():
+            names.setdefault(name, None)
+    return list(names)
+
+
+def find_required_names(nodes):
+    """context names read by the nodes on every run, in order of first use"""
+    names = {}
+    for n in nodes:
+        for name in n.required_names():
+            names.setdefault(name, None)
+    return list(names)
+
+
+def visit_body(nodes, frame):
+    code = visit_nodes(nodes, frame)
+    return code or frame.line("pass")
 
 
 class RootNode(Node):
 
-    def visit(self):
-        return "def output():\n"
+    def visit(self, frame=None):
+        frame = frame or Frame()
+        code = f"from jingu.runtime import {', '.join(runtime.__all__)}\n"
+        if frame.encoding:
+            code += "def output_bytes(context):\n    if 0: yield b''\n"
+            for name in frame.bound:
+                code += frame.line(f"l_{name} = context[{name!r}]")
+            return code
+        if not frame.is_async:
+            code += "def output(context):\n    if 0: yield ''\n"
+            for name in frame.bound:
+                code += frame.line(f"l_{name} = context[{name!r}]")
+            return code
+
+        code += "async def output_async(context):\n    if 0: yield ''\n"
+        for name in frame.bound:
+            code += frame.line(f"l_{name} = await auto_await(context[{name!r}])")
+        return code
 
 
 class SkipNode(Node):
@@ -453,7 +1365,7 @@ class SkipNode(Node):
     def __init__(self, value):
         self.value = value
 
-    def visit(self):
+    def visit(self, frame=None):
         """skip"""
         return ""
 
@@ -463,15 +1375,11 @@ class DataNode(Node):
     def __init__(self, value):
         self.value = value
 
-    def _escape_newline(self):
-        if '\n' in self.value:
-            v = self.value.split('\n')
-            return '\\n'.join(v)
-        return self.value
-
-    def visit(self):
-        v = self._escape_newline()
-        return f"    yield '{v}'\n"
+    def visit(self, frame=None):
+        frame = frame or Frame()
+        if frame.encoding:
+            return frame.line(f"yield {self.value.encode(frame.encoding)!r}")
+        return frame.line(f"yield {self.value!r}")
 
 
 class NameNode(Node):
@@ -479,21 +1387,73 @@ class NameNode(Node):
     def __init__(self, value):
         self.value = value
 
-    def visit(self):
-        return f"    yield {self.value}\n"
+    def find_names(self):
+        if self.value in Frame.CONSTANTS:
+            return ()
+        return (self.value,)
+
+    def expr(self, frame):
+        return frame.load(self.value)
+
+    def is_safe(self, frame):
+        return self.value in Frame.CONSTANTS and self.value not in frame.locals
+
+    def visit(self, frame=None):
+        return visit_expr(self, frame or Frame())
 
 
 class GetNode(Node):
+    """`value.index` or `value[index]`, value is a NameNode or another GetNode"""
 
-    def __init__(self, value, index):
+    def __init__(self, value, index, attribute=False):
         self.value = value
         self.index = index
-
-    def visit(self):
-        if self.index.isdigit():
-            return f"    yield {self.value}[{self.index}]\n"
-        else:
-            return f"    yield {self.value}['{self.index}']\n"
+        self.attribute = attribute
+
+    def find_names(self):
+        return self.value.find_names()
+
+    def iter_child_nodes(self):
+        return (self.value,)
+
+    def is_loop_attribute(self, frame):
+        return (
+            frame.loop is not None
+            and isinstance(self.value, NameNode)
+            and self.value.value == "loop"
+            and "loop" not in frame.locals
+        )
+
+    def expr(self, frame):
+        if self.is_loop_attribute(frame):
+            return frame.loop.attribute(self.index)
+        # plain dicts are by far the most common and are subscripted inline,
+        # as are objects of the type the getter of this lookup site last
+        # resolved with the lookup written here, see runtime.getter();
+        # everything else goes through the getter. The temporaries are
+        # reused by chains, the inner lookup is done before the outer one
+        # assigns them.
+        get = frame.getter(self.index, self.attribute)
+        value = self.value.expr(frame)
+        item = f"tmp[{self.index!r}]"
+        if not self.attribute:
+            return f"({item} if (cls := type(tmp := {value})) is dict or cls is {get}.type else {get}(tmp))"
+        if keyword.iskeyword(self.index):
+            return f"({item} if type(tmp := {value}) is dict else {get}(tmp))"
+        return (
+            f"({item} if (cls := type(tmp := {value})) is dict"
+            f" else tmp.{self.index} if cls is {get}.type else {get}(tmp))"
+        )
+
+    def is_safe(self, frame):
+        return self.is_numeric(frame)
+
+    def is_numeric(self, frame):
+        # loop.index, loop.first, ... are numbers and booleans
+        return self.is_loop_attribute(frame)
+
+    def visit(self, frame=None):
+        return visit_expr(self, frame or Frame())
 
 
 class ConstNode(Node):
@@ -501,59 +1461,288 @@ class ConstNode(Node):
     def __init__(self, value):
         self.value = value
 
+    def expr(self, frame):
+        return str(int(self.value))
+
+    def is_safe(self, frame):
+        return True
+
+    def is_numeric(self, frame):
+        return True
+
+    def visit(self, frame=None):
+        return visit_expr(self, frame or Frame())
+
 
 class CalcNode(Node):
+    OPERATORS = (TokenType.ADD, TokenType.SUB, TokenType.MUL, TokenType.DIV, TokenType.MOD)
 
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
 
-    @property
-    def expand(self):
-        if isinstance(self.left, CalcNode):
-            left = self.left.expand
-        elif isinstance(self.left, NameNode):
-            left = self.left.value
-        else:
-            left = int(self.left.value)
+    def find_names(self):
+        return self.left.find_names() + self.right.find_names()
 
-        if isinstance(self.right, CalcNode):
-            right = self.right.expand
-        elif isinstance(self.right, NameNode):
-            right = self.right.value
-        else:
-            right = int(self.right.value)
+    def iter_child_nodes(self):
+        return (self.left, self.right)
 
-        return f"{left} {self.op} {right}"
+    def expr(self, frame):
+        # the operand tree is flattened back into one expression, so python
+        # applies the usual operator precedence
+        return f"{self.left.expr(frame)} {self.op} {self.right.expr(frame)}"
 
-    def visit(self):
-        if isinstance(self.left, CalcNode):
-            left = self.left.expand
-        elif isinstance(self.left, NameNode):
-            left = self.left.value
-        else:
-            left = int(self.left.value)
+    def is_safe(self, frame):
+        # every operator can be overloaded, e.g. / joins paths and - makes
+        # set differences, only numbers give numbers
+        return self.is_numeric(frame)
 
-        if isinstance(self.right, CalcNode):
-            right = self.right.expand
-        elif isinstance(self.right, NameNode):
-            right = self.right.value
-        else:
-            right = int(self.right.value)
+    def is_numeric(self, frame):
+        return self.left.is_numeric(frame) and self.right.is_numeric(frame)
 
-        return f"    yield str({left} {self.op} {right})\n"
+    def visit(self, frame=None):
+        return visit_expr(self, frame or Frame())
 
 
 class IfNode(Node):
 
     def __init__(self, test, body=None):
         self.test = test
-        self.body = body
-
-    def visit(self):
-        b = self.body._escape_newline()
-        return f"""
-    if {self.test}:
-        yield '{b}'
-"""
+        self.body = body or []
+
+    def find_names(self):
+        names = self.test.find_names()
+        for n in self.body:
+            names += n.find_names()
+        return names
+
+    def required_names(self):
+        return self.test.find_names()
+
+    def iter_child_nodes(self):
+        return [self.test] + self.body
+
+    def visit(self, frame=None):
+        frame = frame or Frame()
+        return frame.line(f"if {self.test.expr(frame)}:") + visit_body(self.body, frame.inner())
+
+
+class CacheNode(Node):
+    """
+    {% cache %}, the body becomes a nested generator function whose output
+    is looked up in the `fragment_cache` global of the generated module.
+    Fragments are stored as str, also by output_bytes(), so that all
+    variants of output() share them.
+    `keys` holds string literals and expression nodes.
+    """
+
+    def __init__(self, keys, ttl=None, body=None):
+        self.keys = keys
+        self.ttl = ttl
+        self.body = body or []
+
+    def key_nodes(self):
+        return [key for key in self.keys if isinstance(key, Node)]
+
+    def find_names(self):
+        names = ()
+        for n in self.key_nodes() + self.body:
+            names += tuple(n.find_names())
+        return names
+
+    def required_names(self):
+        # the body doesn't run when the fragment is cached
+        names = ()
+        for n in self.key_nodes():
+            names += tuple(n.find_names())
+        return names
+
+    def iter_child_nodes(self):
+        return self.key_nodes() + self.body
+
+    def digest(self, frame):
+        """identifies the code of the body, so that different fragments never share a key"""
+        code = visit_body(self.body, Frame(autoescape=frame.autoescape))
+        return hashlib.sha1(code.encode("utf-8")).hexdigest()[:16]
+
+    def visit(self, frame=None):
+        frame = frame or Frame()
+        func = f"fragment_{frame.indent}"
+        keys = "".join(
+            ", " + (key.expr(frame) if isinstance(key, Node) else repr(key)) for key in self.keys
+        )
+        args = f"fragment_cache, fragment_key({self.digest(frame)!r}{keys}), {self.ttl!r}, {func}"
+
+        inner = frame.inner()
+        if frame.is_async:
+            code = frame.line(f"async def {func}():") + inner.line("if 0: yield ''")
+            code += visit_body(self.body, inner)
+            return code + frame.line(f"yield await async_cached_fragment({args})")
+
+        inner.encoding = None
+        code = frame.line(f"def {func}():") + inner.line("if 0: yield ''")
+        code += visit_body(self.body, inner)
+        return code + frame.output(f"cached_fragment({args})")
+
+
+class ExtendsNode(Node):
+    """{% extends %}, resolved by the parser"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class BlockNode(Node):
+    """{% block %}, replaced by its body once inheritance is resolved"""
+
+    def __init__(self, name, body=None):
+        self.name = name
+        self.body = body or []
+
+    def iter_child_nodes(self):
+        return self.body
+
+
+def find_blocks(nodes):
+    for n in nodes:
+        if isinstance(n, BlockNode):
+            yield n
+        body = getattr(n, "body", None)
+        if body:
+            yield from find_blocks(body)
+
+
+def replace_blocks(nodes, blocks):
+    """replace the blocks in the nodes of a base template by the ones in `blocks`"""
+    result = []
+    for n in nodes:
+        if isinstance(n, BlockNode):
+            n = blocks.get(n.name, n)
+        if getattr(n, "body", None):
+            n.body = replace_blocks(n.body, blocks)
+        result.append(n)
+    return result
+
+
+def flatten_blocks(nodes):
+    result = []
+    for n in nodes:
+        if getattr(n, "body", None):
+            n.body = flatten_blocks(n.body)
+        if isinstance(n, BlockNode):
+            result.extend(n.body)
+        else:
+            result.append(n)
+    return result
+
+
+class LoopInfo(object):
+    """
+    The `loop` helper of a for loop. It only exists at compile time: each
+    loop.<attribute> is replaced by an expression on counters kept by the
+    generated loop, and only the counters that the body uses are kept.
+    """
+
+    ATTRIBUTES = ("index", "index0", "first", "last")
+
+    def __init__(self, prefix, attributes):
+        self.prefix = prefix
+        self.attributes = attributes
+
+    @property
+    def counter(self):
+        return f"{self.prefix}index0"
+
+    @property
+    def last(self):
+        return f"{self.prefix}last"
+
+    def attribute(self, name):
+        if name == "index0":
+            return self.counter
+        if name == "index":
+            return f"({self.counter} + 1)"
+        if name == "first":
+            return f"({self.counter} == 0)"
+        if name == "last":
+            return self.last
+        raise ParseError(f"unknown loop attribute '{name}'")
+
+
+class ForNode(Node):
+
+    def __init__(self, target, iter, body=None):
+        self.target = target
+        self.iter = iter
+        self.body = body or []
+
+    def find_names(self):
+        names = self.iter.find_names()
+        body_names = tuple(
+            name for n in self.body for name in n.find_names() if name not in (self.target, "loop")
+        )
+        # the body runs once per item, count its names twice so that they
+        # are bound to fast locals when they are also read on every render
+        return names + body_names + body_names
+
+    def required_names(self):
+        # the body doesn't run for an empty iterable
+        return self.iter.find_names()
+
+    def iter_child_nodes(self):
+        return [self.iter] + self.body
+
+    def loop_attributes(self):
+        """loop.<attribute> names used by the body, not counting nested loops"""
+        attributes = set()
+        if self.target == "loop":
+            # the target shadows the loop helper
+            return attributes
+        todo = list(self.body)
+        while todo:
+            n = todo.pop()
+            if isinstance(n, GetNode) and isinstance(n.value, NameNode) and n.value.value == "loop":
+                attributes.add(n.index)
+            elif isinstance(n, ForNode):
+                todo.append(n.iter)
+                continue
+            todo.extend(n.iter_child_nodes())
+        return attributes
+
+    def visit(self, frame=None):
+        frame = frame or Frame()
+        inner = frame.inner()
+        prefix = f"l_{inner.indent}_"
+        target = f"{prefix}{self.target}"
+        # a loop helper shadows an outer target named loop
+        inner.locals.pop("loop", None)
+        inner.locals[self.target] = target
+
+        attributes = self.loop_attributes()
+        for name in attributes:
+            if name not in LoopInfo.ATTRIBUTES:
+                raise ParseError(f"unknown loop attribute '{name}'")
+        inner.loop = loop = LoopInfo(prefix, attributes)
+        count = bool(attributes & {"index", "index0", "first"})
+
+        iter = self.iter.expr(frame)
+        if "last" in attributes:
+            iter = f"{'async_lookahead' if frame.is_async else 'lookahead'}({iter})"
+            target = f"({target}, {loop.last})"
+        elif frame.is_async:
+            iter = f"auto_aiter({iter})"
+
+        code = ""
+        if frame.is_async:
+            if count:
+                code += frame.line(f"{loop.counter} = -1")
+            code += frame.line(f"async for {target} in {iter}:")
+            if count:
+                code += inner.line(f"{loop.counter} += 1")
+        elif count:
+            code += frame.line(f"for {loop.counter}, {target} in enumerate({iter}):")
+        else:
+            code += frame.line(f"for {target} in {iter}:")
+
+        return code + visit_body(self.body, inner)
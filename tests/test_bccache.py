@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from jingu.bccache import FileSystemBytecodeCache, bc_magic
+from jingu.template import Environment, Template
+
+
+class TestFileSystemBytecodeCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self._tmpdir.name
+        self.addCleanup(self._tmpdir.cleanup)
+
+    def test_dump_and_load(self):
+        bcc = FileSystemBytecodeCache(self.directory)
+        source = "Hello {{ name }}!"
+        self.assertIsNone(bcc.load(source))
+
+        bcc.dump(source, Template(source).code)
+        code = bcc.load(source)
+
+        self.assertIsNotNone(code)
+        self.assertEqual(Template.from_code(source, code).render(name="John"), "Hello John!")
+        self.assertEqual([f for f in os.listdir(self.directory) if f.startswith(".tmp")], [])
+
+    def test_load__source_changed(self):
+        bcc = FileSystemBytecodeCache(self.directory)
+        bcc.dump("Hello {{ name }}!", Template("Hello {{ name }}!").code)
+        self.assertIsNone(bcc.load("Bye {{ name }}!"))
+
+    def test_load__options(self):
+        bcc = FileSystemBytecodeCache(self.directory)
+        source = "{{ name }}"
+        bcc.dump(source, Template(source, autoescape=True).code, {"autoescape": True})
+        self.assertIsNone(bcc.load(source, {"autoescape": False}))
+        self.assertIsNotNone(bcc.load(source, {"autoescape": True}))
+
+    def test_load__bytes_source(self):
+        bcc = FileSystemBytecodeCache(self.directory)
+        source = "Héllo {{ name }}!"
+        bcc.dump(source, Template(source).code)
+        self.assertIsNotNone(bcc.load(source.encode("utf-8")))
+
+    def test_load__corrupt_entry(self):
+        bcc = FileSystemBytecodeCache(self.directory)
+        source = "Hello {{ name }}!"
+        filename = bcc._get_cache_filename(bcc.get_cache_key(source))
+
+        for data in [b"", b"garbage", bc_magic, bc_magic + b"\xff\x00"]:
+            with self.subTest(data=data):
+                with open(filename, "wb") as f:
+                    f.write(data)
+                self.assertIsNone(bcc.load(source))
+
+    def test_clear(self):
+        bcc = FileSystemBytecodeCache(self.directory)
+        bcc.dump("Hello", Template("Hello").code)
+        bcc.clear()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_environment__skips_compile(self):
+        bcc = FileSystemBytecodeCache(self.directory)
+        path = os.path.join(self.directory, "t.html")
+        with open(path, "w") as f:
+            f.write("Hello {{ name }}!")
+
+        Environment(bytecode_cache=bcc).get_template(path).code
+
+        with mock.patch.object(Template, "tokenize") as tokenize:
+            tmpl = Environment(bytecode_cache=bcc).get_template(path)
+            self.assertEqual(tmpl.render(name="John"), "Hello John!")
+        tokenize.assert_not_called()
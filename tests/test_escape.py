@@ -0,0 +1,84 @@
+from pathlib import PurePosixPath
+import unittest
+
+from jingu import Environment, Markup, Template, escape
+from jingu.runtime import escape_str
+
+
+class TestEscape(unittest.TestCase):
+    def test_escape_str(self):
+        self.assertEqual(escape_str("<a href=\"x\">'&'</a>"), "&lt;a href=&#34;x&#34;&gt;&#39;&amp;&#39;&lt;/a&gt;")
+        self.assertEqual(escape_str("plain"), "plain")
+        self.assertEqual(escape_str(42), "42")
+        self.assertEqual(escape_str(None), "None")
+        self.assertEqual(escape_str(Markup("<b>")), "<b>")
+
+    def test_markup(self):
+        self.assertIsInstance(escape("<"), Markup)
+        self.assertEqual(escape("<"), "&lt;")
+        self.assertEqual(escape(Markup("<b>")), "<b>")
+        self.assertEqual(Markup("<b>") + "<", "<b>&lt;")
+        self.assertEqual("<" + Markup("<b>"), "&lt;<b>")
+        self.assertEqual(repr(Markup("x")), "Markup('x')")
+
+    def test_markup_formatting_escapes_arguments(self):
+        cases = [
+            (Markup("<b>%s</b>") % "<i>", "<b>&lt;i&gt;</b>"),
+            (Markup("%s %d %.1f %s") % ("<", 3, 2.5, Markup("<i>")), "&lt; 3 2.5 <i>"),
+            (Markup("%(a)s") % {"a": "&"}, "&amp;"),
+            (Markup("<br>").join(["<", Markup("<i>")]), "&lt;<br><i>"),
+            (Markup("<p>{0} {x:.2f} {y}</p>").format("<", x=1.5, y=Markup("<i>")), "<p>&lt; 1.50 <i></p>"),
+            (Markup("{a}").format_map({"a": "'"}), "&#39;"),
+        ]
+        for actual, expected in cases:
+            with self.subTest(expected=expected):
+                self.assertIsInstance(actual, Markup)
+                self.assertEqual(actual, expected)
+
+    def test_formatted_markup_not_escaped_again(self):
+        tmpl = Template("{{ link }}", autoescape=True)
+        self.assertEqual(tmpl.render(link=Markup("<a>%s</a>") % "<x>"), "<a>&lt;x&gt;</a>")
+
+
+class TestAutoescape(unittest.TestCase):
+    def test_render(self):
+        tmpl = Template("<p>{{ name }}</p>{{ user.bio }}{{ html }}", autoescape=True)
+        actual = tmpl.render(name="<script>", user={"bio": "a & b"}, html=Markup("<i>ok</i>"))
+        self.assertEqual(actual, "<p>&lt;script&gt;</p>a &amp; b<i>ok</i>")
+
+    def test_render__disabled(self):
+        self.assertEqual(Template("{{ name }}").render(name="<b>"), "<b>")
+
+    def test_environment(self):
+        env = Environment(autoescape=True)
+        self.assertTrue(Template("{{ x }}", environment=env).autoescape)
+        self.assertFalse(Template("{{ x }}", environment=env, autoescape=False).autoescape)
+        self.assertTrue(env.compile_options()["autoescape"])
+
+    def test_safe_expressions_not_escaped(self):
+        tmpl = Template(
+            "{{ 1 + 2 }}{{ True }}"
+            "{% for x in xs %}{{ loop.index }}{{ loop.index * 2 }}{{ loop.index0 - 1 / 2 }}{% endfor %}",
+            autoescape=True,
+        )
+        self.assertNotIn("escape_str(", tmpl.compile_source())
+        self.assertEqual(tmpl.render(xs=[0]), "3True12-0.5")
+
+    def test_arithmetic_on_context_values_escaped(self):
+        tmpl = Template("{{ a + b }}{{ a * n }}{{ a - b }}{{ a / 2 }}{{ n - 1 }}", autoescape=True)
+        self.assertEqual(tmpl.compile_source().count("escape_str("), 5)
+        self.assertEqual(tmpl.render(a=6, b=2, n=2), "81243.01")
+        self.assertEqual(Template("{{ a + b }}{{ a * n }}", autoescape=True).render(a="<", b="b>", n=2), "&lt;b&gt;&lt;&lt;")
+
+    def test_overloaded_operators_escaped(self):
+        tmpl = Template("{{ base / name }}|{{ a - b }}", autoescape=True)
+        actual = tmpl.render(
+            base=PurePosixPath("/u"), name='"><script>x</script>', a={"<img onerror=x>", "y"}, b={"y"}
+        )
+        self.assertEqual(actual, "/u/&#34;&gt;&lt;script&gt;x&lt;/script&gt;|{&#39;&lt;img onerror=x&gt;&#39;}")
+
+
+class TestAutoescapeAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_render_async(self):
+        tmpl = Template("{{ name }}{{ 1 + 1 }}", autoescape=True)
+        self.assertEqual(await tmpl.render_async(name="<"), "&lt;2")
@@ -0,0 +1,167 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from jingu.fragcache import FileSystemFragmentCache, MemoryFragmentCache
+from jingu.template import Environment, ParseError, Template
+
+
+class TestMemoryFragmentCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = MemoryFragmentCache()
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", "<nav/>")
+        cache.set("b", "")
+        self.assertEqual(cache.get("a"), "<nav/>")
+        self.assertEqual(cache.get("b"), "")
+        self.assertEqual(cache.cache_info(), (2, 1, 0, 1024, 2))
+
+    def test_lru_eviction(self):
+        cache = MemoryFragmentCache(maxsize=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.cache_info().evictions, 1)
+
+    def test_ttl(self):
+        cache = MemoryFragmentCache()
+        with mock.patch("time.time", return_value=1000.0):
+            cache.set("a", "1", ttl=10)
+        with mock.patch("time.time", return_value=1009.0):
+            self.assertEqual(cache.get("a"), "1")
+        with mock.patch("time.time", return_value=1010.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_cleanup(self):
+        cache = MemoryFragmentCache()
+        with mock.patch("time.time", return_value=1000.0):
+            cache.set("a", "1", ttl=10)
+            cache.set("b", "2", ttl=20)
+            cache.set("c", "3")
+        with mock.patch("time.time", return_value=1010.0):
+            self.assertEqual(cache.cleanup(), 1)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.get("b"), "2")
+
+
+class TestFileSystemFragmentCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.directory = self._tmpdir.name
+
+    def test_shared(self):
+        FileSystemFragmentCache(self.directory).set("nav\x1f1", "<nav>é</nav>")
+        other = FileSystemFragmentCache(self.directory)
+        self.assertEqual(other.get("nav\x1f1"), "<nav>é</nav>")
+        self.assertIsNone(other.get("nav\x1f2"))
+        self.assertEqual(other.cache_info(), (1, 1, 0, None, 1))
+        self.assertEqual([f for f in os.listdir(self.directory) if f.startswith(".tmp")], [])
+
+    def test_ttl(self):
+        cache = FileSystemFragmentCache(self.directory)
+        cache.set("a", "1", ttl=60)
+        cache.set("b", "2")
+        self.assertEqual(cache.get("a"), "1")
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("b"), "2")
+        # the expired file was deleted by the lookup
+        self.assertEqual(len(cache), 1)
+
+    def test_cleanup(self):
+        cache = FileSystemFragmentCache(self.directory)
+        cache.set("a", "1", ttl=60)
+        cache.set("b", "2", ttl=120)
+        cache.set("c", "3")
+        with open(os.path.join(self.directory, "__jingu_fragment_broken"), "wb"):
+            pass
+        self.assertEqual(cache.cleanup(), 0)
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertEqual(cache.cleanup(), 1)
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("b"), "2")
+            self.assertEqual(cache.get("c"), "3")
+        self.assertEqual(len(cache), 3)
+
+    def test_counters_under_lock(self):
+        cache = FileSystemFragmentCache(self.directory)
+        with cache._lock:
+            thread = threading.Thread(target=cache.get, args=("a",))
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(cache.misses, 0)
+        thread.join()
+        self.assertEqual(cache.cache_info()[:2], (0, 1))
+
+    def test_clear(self):
+        cache = FileSystemFragmentCache(self.directory)
+        cache.set("a", "1")
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestCacheTag(unittest.TestCase):
+    def test_render(self):
+        env = Environment()
+        tmpl = Template(
+            "<p>{% cache 'nav' user.id %}{% for x in items %}{{ x }}{% endfor %}{% endcache %}</p>",
+            environment=env,
+        )
+        self.assertEqual(tmpl.render(user={"id": 1}, items=[1, 2]), "<p>12</p>")
+        self.assertEqual(tmpl.render(user={"id": 1}, items=[3]), "<p>12</p>")
+        self.assertEqual(tmpl.render(user={"id": 2}, items=[3]), "<p>3</p>")
+        info = env.fragment_cache.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+
+    def test_ttl(self):
+        env = Environment()
+        tmpl = Template("{% cache 'k' 30 %}{{ value }}{% endcache %}", environment=env)
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertEqual(tmpl.render(value="a"), "a")
+            self.assertEqual(tmpl.render(value="b"), "a")
+        with mock.patch("time.time", return_value=1031.0):
+            self.assertEqual(tmpl.render(value="c"), "c")
+
+    def test_different_bodies_dont_share_keys(self):
+        env = Environment()
+        first = Template("{% cache 'sidebar' %}first{% endcache %}", environment=env)
+        second = Template("{% cache 'sidebar' %}second{{ x }}{% endcache %}", environment=env)
+        self.assertEqual(first.render(), "first")
+        self.assertEqual(second.render(x="!"), "second!")
+
+    def test_without_environment(self):
+        tmpl = Template("{% cache 'k' %}{{ value }}{% endcache %}")
+        self.assertEqual(tmpl.render(value="a"), "a")
+        self.assertEqual(tmpl.render(value="b"), "b")
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as d:
+            source = "{% cache 'k' n %}{{ value }}{% endcache %}"
+            first = Environment(fragment_cache=FileSystemFragmentCache(d))
+            self.assertEqual(Template(source, environment=first).render(n=1, value="a"), "a")
+            second = Environment(fragment_cache=FileSystemFragmentCache(d))
+            self.assertEqual(Template(source, environment=second).render(n=1, value="b"), "a")
+
+    def test_parse_errors(self):
+        for source in ["{% cache 'k' %}", "{% cache 'k' %}{% endif %}"]:
+            with self.subTest(source=source):
+                with self.assertRaises(ParseError):
+                    Template(source).render()
+
+
+class TestCacheTagAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_render_async_shares_fragments(self):
+        env = Environment()
+        tmpl = Template("{% cache 'k' %}{{ value }}{% endcache %}", environment=env)
+        self.assertEqual(await tmpl.render_async(value="a"), "a")
+        self.assertEqual(tmpl.render(value="b"), "a")
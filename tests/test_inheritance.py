@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+
+from jingu.bccache import FileSystemBytecodeCache
+from jingu.template import Environment, ParseError, Template
+
+
+class InheritanceTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.dir = self._tmpdir.name
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, source, mtime=None):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(source)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+
+class TestInclude(InheritanceTestCase):
+    def test_include(self):
+        self.write("partials/header.html", "<h1>{{ title }}</h1>")
+        tmpl = Template('{% include "partials/header.html" %}<p>{{ body }}</p>', name=self.path("page.html"))
+        self.assertEqual(tmpl.render(title="T", body="B"), "<h1>T</h1><p>B</p>")
+
+    def test_include__inlined(self):
+        self.write("header.html", "<h1>Header</h1>")
+        tmpl = Template('{% include "header.html" %}<p>{{ body }}</p>', name=self.path("page.html"))
+        source = tmpl.compile_source()
+        self.assertIn("yield '<h1>Header</h1><p>'", source)
+        self.assertNotIn("header.html'", source.split("dependencies")[0])
+
+    def test_include__nested_relative(self):
+        self.write("partials/item.html", '<li>{{ item }}</li>')
+        self.write("partials/list.html", '{% for item in items %}{% include "item.html" %}{% endfor %}')
+        tmpl = Template('<ul>{% include "partials/list.html" %}</ul>', name=self.path("page.html"))
+        self.assertEqual(tmpl.render(items=[1, 2]), "<ul><li>1</li><li>2</li></ul>")
+        self.assertEqual(
+            sorted(tmpl.dependencies), [self.path("partials/item.html"), self.path("partials/list.html")]
+        )
+
+    def test_include__errors(self):
+        self.write("a.html", '{% include "b.html" %}')
+        self.write("b.html", '{% include "a.html" %}')
+        with self.assertRaisesRegex(ParseError, "includes or extends itself"):
+            Template('{% include "a.html" %}', name=self.path("page.html")).render()
+        with self.assertRaisesRegex(ParseError, "not found"):
+            Template('{% include "missing.html" %}', name=self.path("page.html")).render()
+        with self.assertRaises(ParseError):
+            Template('{% include name %}', name=self.path("page.html")).render()
+
+
+class TestExtends(InheritanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write(
+            "base.html",
+            "<title>{% block title %}Default{% endblock %}</title>"
+            "<main>{% block content %}{% endblock content %}</main>",
+        )
+
+    def test_extends(self):
+        tmpl = Template(
+            '{% extends "base.html" %}ignored{% block content %}<p>{{ body }}</p>{% endblock %}',
+            name=self.path("page.html"),
+        )
+        self.assertEqual(tmpl.render(body="B"), "<title>Default</title><main><p>B</p></main>")
+
+    def test_extends__multi_level(self):
+        self.write(
+            "layout.html",
+            '{% extends "base.html" %}{% block content %}<nav/>{% block main %}main{% endblock %}{% endblock %}',
+        )
+        tmpl = Template(
+            '{% extends "layout.html" %}{% block title %}{{ title }}{% endblock %}'
+            '{% block main %}{% if show %}shown{% endif %}{% endblock %}',
+            name=self.path("page.html"),
+        )
+        self.assertEqual(tmpl.render(title="T", show=True), "<title>T</title><main><nav/>shown</main>")
+
+    def test_extends__errors(self):
+        with self.assertRaises(ParseError):
+            Template('{% if x %}{% extends "base.html" %}{% endif %}', name=self.path("page.html")).render()
+        with self.assertRaises(ParseError):
+            Template("{% block a %}{% endblock b %}").render()
+        with self.assertRaises(ParseError):
+            Template('{% extends "base.html" %}{% block a %}{% endblock %}{% block a %}{% endblock %}',
+                     name=self.path("page.html")).render()
+
+
+class TestDependencies(InheritanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.header = self.write("header.html", "<h1>old</h1>", mtime=1000000000)
+        self.page = self.write("page.html", '{% include "header.html" %}page', mtime=1000000000)
+        self.other = self.write("other.html", "other", mtime=1000000000)
+
+    def test_partial_change_reloads_dependents_only(self):
+        env = Environment(check_interval=0)
+        self.assertEqual(env.get_template(self.page).render(), "<h1>old</h1>page")
+        other = env.get_template(self.other)
+        self.assertEqual(env.dependents(self.header), {self.page})
+
+        self.write("header.html", "<h1>new</h1>", mtime=1000000001)
+        self.assertEqual(env.get_template(self.page).render(), "<h1>new</h1>page")
+        self.assertIs(env.get_template(self.other), other)
+
+    def test_invalidate(self):
+        env = Environment(check_interval=3600)
+        page = env.get_template(self.page)
+        other = env.get_template(self.other)
+
+        self.assertEqual(env.invalidate(self.header), {self.page})
+        self.assertIsNot(env.get_template(self.page), page)
+        self.assertIs(env.get_template(self.other), other)
+
+    def test_bytecode_cache_checks_dependencies(self):
+        bcc = FileSystemBytecodeCache(self.path("bcc"))
+        self.assertEqual(Environment(bytecode_cache=bcc).get_template(self.page).render(), "<h1>old</h1>page")
+
+        self.write("header.html", "<h1>new</h1>")
+        self.assertEqual(Environment(bytecode_cache=bcc).get_template(self.page).render(), "<h1>new</h1>page")
@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+import os
+import tempfile
+import unittest
+
+from jingu import Lazy, Template
+from jingu.template import Environment
+
+
+class Counter(object):
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestReferencedNames(unittest.TestCase):
+    def test_referenced_names(self):
+        tmpl = Template(
+            "{{ title }}{% if user.admin %}{{ stats['count'] + offset }}{% endif %}"
+            "{% for item in items %}{{ item.name }}{{ loop.index }}{{ sep }}{% endfor %}{{ None }}"
+        )
+        self.assertEqual(tmpl.referenced_names(), {"title", "user", "stats", "offset", "items", "sep"})
+
+    def test_referenced_names__optimized_away(self):
+        self.assertEqual(Template("{% if False %}{{ hidden }}{% endif %}{{ shown }}").referenced_names(), {"shown"})
+
+    def test_referenced_names__include(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "partial.html"), "w") as f:
+                f.write("{{ footer }}")
+            tmpl = Template('{{ body }}{% include "partial.html" %}', name=os.path.join(d, "page.html"))
+            self.assertEqual(tmpl.referenced_names(), {"body", "footer"})
+
+    def test_referenced_names__precompiled(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "page.html")
+            with open(path, "w") as f:
+                f.write("{{ a }}{{ b.c }}")
+            out_dir = os.path.join(d, "build")
+            os.mkdir(out_dir)
+            env = Environment(precompiled_dir=out_dir)
+            env.write_precompiled(path, out_dir)
+            tmpl = env.get_template(path)
+            self.assertIsNone(tmpl.source)
+            self.assertEqual(tmpl.referenced_names(), {"a", "b"})
+
+
+class TestLazy(unittest.TestCase):
+    def test_not_evaluated_when_not_reached(self):
+        stats = Counter(42)
+        tmpl = Template("{% if admin %}{{ stats }}{% endif %}")
+        self.assertEqual(tmpl.render(admin=False, stats=Lazy(stats)), "")
+        self.assertEqual(stats.calls, 0)
+
+    def test_evaluated_once(self):
+        stats = Counter({"count": 3, "items": ["a", "b"]})
+        tmpl = Template(
+            "{{ stats.count }}{{ stats['count'] + 1 }}"
+            "{% for x in stats.items %}{{ x }}{% endfor %}{% if stats %}!{% endif %}"
+        )
+        self.assertEqual(tmpl.render(stats=Lazy(stats)), "34ab!")
+        self.assertEqual(stats.calls, 1)
+
+    def test_value_kinds(self):
+        @dataclass
+        class User(object):
+            name: str
+
+        tmpl = Template("{{ user.name }} {{ n * 2 }} {{ 10 - n }}{% for x in xs %}{{ x }}{% endfor %}")
+        context = {"user": Lazy(lambda: User("ann")), "n": Lazy(lambda: 3), "xs": Lazy(lambda: iter("ab"))}
+        self.assertEqual(tmpl.render(context), "ann 6 7ab")
+
+    def test_autoescape(self):
+        tmpl = Template("{{ html }}", autoescape=True)
+        self.assertEqual(tmpl.render(html=Lazy(lambda: "<b>")), "&lt;b&gt;")
+
+    def test_repr(self):
+        value = Lazy(lambda: 1)
+        self.assertTrue(repr(value).startswith("Lazy(<function"))
+        self.assertEqual(value + 1, 2)
+        self.assertEqual(repr(value), "Lazy(value=1)")
+
+
+class TestLazyAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_render_async(self):
+        stats = Counter(5)
+        tmpl = Template("{% if show %}{{ stats }}{% endif %}")
+        self.assertEqual(await tmpl.render_async(show=False, stats=Lazy(stats)), "")
+        self.assertEqual(await tmpl.render_async(show=True, stats=Lazy(stats)), "5")
+        self.assertEqual(stats.calls, 1)
@@ -0,0 +1,118 @@
+import unittest
+
+from jingu.lexer import Lexer, Token, TokenStream, TokenType
+
+
+class TestLexer(unittest.TestCase):
+    def test_tokenize__empty(self):
+        self.assertEqual(Lexer().tokenize(""), [])
+
+    def test_tokenize__data_only(self):
+        source = "<p>{ not a tag }</p>\n" * 1000
+        self.assertEqual(Lexer().tokenize(source), [Token(TokenType.DATA, source)])
+
+    def test_tokenize__whitespace(self):
+        tokens = Lexer().tokenize("{{foo}}{{  1+2  }}")
+        self.assertEqual(tokens, [
+            Token(TokenType.VARIABLE_BEGIN, "{{"),
+            Token(TokenType.NAME, "foo"),
+            Token(TokenType.VARIABLE_END, "}}"),
+            Token(TokenType.VARIABLE_BEGIN, "{{"),
+            Token(TokenType.INTEGER, "1"),
+            Token(TokenType.ADD, "+"),
+            Token(TokenType.INTEGER, "2"),
+            Token(TokenType.VARIABLE_END, "}}"),
+        ])
+
+    def test_tokenize__operand_after_operator(self):
+        tokens = Lexer().tokenize('{{ 1 + foo["key"] }}')
+        self.assertEqual(tokens[3], Token(TokenType.NAME, "foo"))
+        self.assertEqual(tokens[5], Token(TokenType.STRING, "key"))
+
+    def test_tokenize__chained_lookup(self):
+        tokens = Lexer().tokenize("{{ a.b[0]['c'].d }}")
+        self.assertEqual(
+            [t.type for t in tokens][1:-1],
+            [TokenType.NAME, TokenType.DOT, TokenType.NAME, TokenType.LBRACKET, TokenType.INTEGER,
+             TokenType.RBRACKET, TokenType.LBRACKET, TokenType.STRING, TokenType.RBRACKET, TokenType.DOT,
+             TokenType.NAME],
+        )
+
+    def test_tokenize__bytes(self):
+        source = "<p>é</p>\n  {%- if a -%}\n{{ a.b['ü'] + 1 }}\n  {% endif %}\n"
+        for lexer in [Lexer(), Lexer(trim_blocks=True, lstrip_blocks=True)]:
+            with self.subTest(trim_blocks=lexer.trim_blocks):
+                tokens = lexer.tokenize(source.encode("utf-8"))
+                self.assertEqual(tokens, lexer.tokenize(source))
+                # offsets count bytes
+                self.assertEqual((tokens.ends[0], tokens.value(0)), (len("<p>é</p>".encode("utf-8")), "<p>é</p>"))
+
+    def test_tokenize__bytes_syntax_error(self):
+        with self.assertRaisesRegex(SyntaxError, "unexpected 'a' at position 5"):
+            Lexer().tokenize("{{ 1 a }}".encode("utf-8"))
+
+    def test_tokenize__whitespace_control(self):
+        tokens = Lexer().tokenize("<a>\n  {{- x -}}\n  </a> {%- if y -%} \n b")
+        self.assertEqual([t.value for t in tokens if t.type == TokenType.DATA], ["<a>", "</a>", "b"])
+        self.assertEqual(tokens[1], Token(TokenType.VARIABLE_BEGIN, "{{-"))
+        self.assertEqual(tokens[3], Token(TokenType.VARIABLE_END, "-}}"))
+
+    def test_tokenize__minus_is_not_a_marker(self):
+        tokens = Lexer().tokenize("{{ a - b }}{{ a -b }}")
+        self.assertEqual([t.type for t in tokens].count(TokenType.SUB), 2)
+
+    def test_tokenize__trim_blocks(self):
+        source = "<ul>\n  {% for x in xs %}\n  <li>{{ x }}</li>\n  {% endfor %}\n</ul>"
+        data = lambda lexer: [t.value for t in lexer.tokenize(source) if t.type == TokenType.DATA]
+        self.assertEqual(data(Lexer(trim_blocks=True)), ["<ul>\n  ", "  <li>", "</li>\n  ", "</ul>"])
+        self.assertEqual(data(Lexer(lstrip_blocks=True)), ["<ul>\n", "\n  <li>", "</li>\n", "\n</ul>"])
+        self.assertEqual(data(Lexer(trim_blocks=True, lstrip_blocks=True)), ["<ul>\n", "  <li>", "</li>\n", "</ul>"])
+
+    def test_tokenize__lstrip_blocks_only_at_line_start(self):
+        tokens = Lexer(lstrip_blocks=True).tokenize("a  {% if x %}{{ y }}  {% endif %}")
+        self.assertEqual([t.value for t in tokens if t.type == TokenType.DATA], ["a  ", "  "])
+
+    def test_tokenize__syntax_error(self):
+        for s in [
+            "{{ dummy",
+            "{{ dummy +",
+            "{{ dummy[0 }}",
+            "{{ dummy. }}",
+            "{{ dummy.a. }}",
+            "{{ dummy[0][ }}",
+            "{{ 1 2 }}",
+            "{{ dummy %}",
+            "{% %}",
+            "{% if dummy",
+        ]:
+            with self.subTest(s=s):
+                with self.assertRaises(SyntaxError):
+                    Lexer().tokenize(s)
+
+
+class TestTokenStream(unittest.TestCase):
+    def test_offsets(self):
+        source = "<p>{{ foo['bar'] }}</p>"
+        tokens = Lexer().tokenize(source)
+        self.assertIsInstance(tokens, TokenStream)
+        self.assertIs(tokens.source, source)
+        self.assertEqual(tokens.type(4), TokenType.STRING)
+        self.assertEqual(tokens.value(4), "bar")
+        self.assertEqual((tokens.starts[4], tokens.ends[4]), (11, 14))
+
+    def test_sequence(self):
+        tokens = Lexer().tokenize("a{{ b }}")
+        self.assertEqual(len(tokens), 4)
+        self.assertEqual(tokens[-1], Token(TokenType.VARIABLE_END, "}}"))
+        self.assertEqual(tokens[1:3], [Token(TokenType.VARIABLE_BEGIN, "{{"), Token(TokenType.NAME, "b")])
+        self.assertEqual(tokens, list(tokens))
+
+    def test_from_tokens(self):
+        tokens = [Token(TokenType.DATA, "<p>"), Token(TokenType.VARIABLE_BEGIN, "{{"), Token(TokenType.NAME, "x")]
+        stream = TokenStream.from_tokens(tokens)
+        self.assertEqual(stream, tokens)
+        self.assertEqual(stream.value(2), "x")
+
+    def test_token_slots(self):
+        with self.assertRaises(AttributeError):
+            Token(TokenType.DATA, "x").extra = 1
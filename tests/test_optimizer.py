@@ -0,0 +1,42 @@
+import unittest
+
+from jingu.optimizer import optimize
+from jingu.template import CalcNode, DataNode, IfNode, NameNode, RootNode, Template
+
+
+class TestOptimizer(unittest.TestCase):
+    def optimize(self, source):
+        tmpl = Template(source)
+        return optimize(tmpl.parse(tmpl.tokenize(source)))
+
+    def test_fold_constants(self):
+        nodes = self.optimize("1 + 2 * 3 = {{ 1 + 2 * 3 }}, {{ 7 }}!")
+        self.assertIsInstance(nodes[0], RootNode)
+        self.assertEqual(len(nodes), 2)
+        self.assertIsInstance(nodes[1], DataNode)
+        self.assertEqual(nodes[1].value, "1 + 2 * 3 = 7, 7!")
+
+    def test_keep_variables(self):
+        nodes = self.optimize("<p>{{ 1 + 2 }} {{ n + 1 }}</p>")
+        self.assertEqual(len(nodes), 4)
+        self.assertEqual(nodes[1].value, "<p>3 ")
+        self.assertIsInstance(nodes[2], CalcNode)
+        self.assertEqual(nodes[3].value, "</p>")
+
+    def test_keep_zero_division(self):
+        nodes = self.optimize("{{ 1 / 0 }}")
+        self.assertIsInstance(nodes[1], CalcNode)
+        with self.assertRaises(ZeroDivisionError):
+            Template("{{ 1 / 0 }}").render()
+
+    def test_fold_constant_if(self):
+        nodes = self.optimize("a{% if True %}b{% endif %}c{% if False %}d{% endif %}{% if x %}e{% endif %}")
+        self.assertEqual(len(nodes), 3)
+        self.assertEqual(nodes[1].value, "abc")
+        self.assertIsInstance(nodes[2], IfNode)
+
+    def test_render_unoptimized(self):
+        tmpl = Template("{{ 1 + 2 }} {{ n }} {{ 4 }}")
+        tmpl.optimized = False
+        self.assertEqual(tmpl.render(n=NameNode), f"3 {NameNode} 4")
+        self.assertEqual(list(Template("{{ 1 + 2 }}-{{ n }}-").generate(n=1)), ["3-", "1", "-"])
@@ -0,0 +1,161 @@
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from jingu.__main__ import main
+from jingu.bccache import FileSystemBytecodeCache
+from jingu.template import Environment, Template
+
+TEMPLATES = {
+    "index.html": "<h1>{{ title }}</h1>{{ 1 + 2 }} {{ n * 3 }}",
+    "list.html": "<ul>{% for item in items %}<li>{{ loop.index }} {{ item['name'] }}</li>{% endfor %}</ul>",
+    os.path.join("partials", "nav.html"): "{% if user.admin %}<a>{{ user.name }}</a>{% endif %}",
+}
+
+CONTEXT = {
+    "title": "Hello 'world'\n",
+    "n": 7,
+    "items": [{"name": "a"}, {"name": "b"}],
+    "user": {"admin": True, "name": "John"},
+}
+
+
+class TestPrecompiled(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.templates_dir = os.path.join(self._tmpdir.name, "templates")
+        self.out_dir = os.path.join(self._tmpdir.name, "build")
+
+        for name, source in TEMPLATES.items():
+            path = os.path.join(self.templates_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(source)
+
+        with redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(main(["compile", self.templates_dir, "-o", self.out_dir]), 0)
+        self.assertIn("compiled 3 templates", out.getvalue())
+
+    def env(self, **options):
+        return Environment(precompiled_dir=self.out_dir, templates_dir=self.templates_dir, **options)
+
+    def paths(self):
+        return [os.path.join(self.templates_dir, name) for name in TEMPLATES]
+
+    def test_same_output_as_runtime(self):
+        runtime_env = Environment()
+        precompiled_env = self.env()
+
+        for path in self.paths():
+            with self.subTest(path=path):
+                with mock.patch.object(Template, "tokenize") as tokenize:
+                    precompiled = precompiled_env.get_template(path)
+                    actual = precompiled.render(CONTEXT)
+                tokenize.assert_not_called()
+                self.assertIsNone(precompiled.source)
+                self.assertEqual(actual, runtime_env.get_template(path).render(CONTEXT))
+
+    def test_same_source_as_runtime(self):
+        for path in self.paths():
+            with self.subTest(path=path):
+                tmpl = Environment().get_template(path)
+                module = self.env()._load_precompiled(path).path
+                with open(module) as f:
+                    self.assertIn(tmpl.compile_source(), f.read())
+
+    def test_render_async(self):
+        env = self.env()
+        for path in self.paths():
+            with self.subTest(path=path):
+                actual = asyncio.run(env.get_template(path).render_async(CONTEXT))
+                self.assertEqual(actual, Environment().get_template(path).render(CONTEXT))
+
+    def test_render_bytes(self):
+        env = self.env()
+        for path in self.paths():
+            with self.subTest(path=path):
+                actual = b"".join(env.get_template(path).render_bytes(CONTEXT))
+                self.assertEqual(actual, Environment().get_template(path).render(CONTEXT).encode("utf-8"))
+
+    def test_other_compile_options_not_loaded(self):
+        path = os.path.join(self.templates_dir, "index.html")
+        self.assertIsNotNone(self.env()._load_precompiled(path))
+
+        env = self.env(autoescape=True)
+        self.assertIsNone(env._load_precompiled(path))
+        tmpl = env.get_template(path)
+        self.assertIsNotNone(tmpl.source)
+        self.assertIn("Hello &#39;world&#39;", tmpl.render(CONTEXT))
+
+    def test_spelling_of_the_path(self):
+        relative = os.path.join(self.templates_dir, "partials", "..", "index.html")
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self._tmpdir.name)
+        for path in [relative, os.path.join("templates", "index.html"), os.path.join(".", "templates", "index.html")]:
+            with self.subTest(path=path):
+                self.assertIsNone(self.env().get_template(path).source)
+
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(main(["compile", "templates", "-o", "relative"]), 0)
+        os.chdir(cwd)
+        env = Environment(precompiled_dir=os.path.join(self._tmpdir.name, "relative"), templates_dir=self.templates_dir)
+        self.assertIsNone(env.get_template(os.path.join(self.templates_dir, "index.html")).source)
+
+    def test_fallback_to_source(self):
+        env = self.env()
+        with self.assertWarnsRegex(RuntimeWarning, "no precompiled module for 'tests/data/test_template.html'"):
+            tmpl = env.get_template('tests/data/test_template.html')
+        self.assertIsNotNone(tmpl.source)
+        self.assertIn("<title>T</title>", tmpl.render(title="T", body="B"))
+
+
+class TestCompileTemplates(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.paths = []
+        for i in range(6):
+            path = os.path.join(self._tmpdir.name, f"t{i}.html")
+            with open(path, "w") as f:
+                f.write(f"<p>{i}: {{{{ name }}}}</p>")
+            self.paths.append(path)
+
+        self.broken = os.path.join(self._tmpdir.name, "broken.html")
+        with open(self.broken, "w") as f:
+            f.write("<p>{{ name </p>")
+
+    def test_into_cache(self):
+        env = Environment()
+        report = env.compile_templates(self.paths + [self.broken], workers=2)
+
+        self.assertEqual(sorted(report.compiled), sorted(self.paths))
+        self.assertEqual(list(report.errors), [self.broken])
+        self.assertIn("SyntaxError", report.errors[self.broken])
+        self.assertGreater(report.throughput, 0)
+
+        with mock.patch.object(Template, "tokenize") as tokenize:
+            self.assertEqual(env.get_template(self.paths[3]).render(name="x"), "<p>3: x</p>")
+        tokenize.assert_not_called()
+        self.assertEqual(env.cache_info().hits, 1)
+
+    def test_into_bytecode_cache(self):
+        bcc = FileSystemBytecodeCache(os.path.join(self._tmpdir.name, "bcc"))
+        env = Environment(cache_size=0, bytecode_cache=bcc)
+        report = env.compile_templates(self.paths, workers=1)
+        self.assertEqual(len(report.compiled), 6)
+
+        with open(self.paths[0]) as f:
+            self.assertIsNotNone(bcc.load(f.read(), env.compile_options()))
+
+    def test_cli_errors(self):
+        out_dir = os.path.join(self._tmpdir.name, "build")
+        with redirect_stdout(io.StringIO()), mock.patch("sys.stderr", new_callable=io.StringIO) as err:
+            self.assertEqual(main(["compile", self._tmpdir.name, "-o", out_dir, "-j", "2"]), 1)
+        self.assertIn("broken.html", err.getvalue())
+        self.assertEqual(len(os.listdir(out_dir)), 6)
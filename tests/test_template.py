@@ -1,8 +1,18 @@
-from collections import namedtuple
+import asyncio
+from collections import UserDict, namedtuple
+from dataclasses import dataclass
+import io
+import mmap
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 
-from jingu.template import Environment, Template, NameNode, DataNode, GetNode, RootNode, SkipNode, CalcNode, ConstNode
+from jingu.template import Environment, ParseError, Template, NameNode, DataNode, GetNode, RootNode, SkipNode, CalcNode, ConstNode
+from jingu.bccache import FileSystemBytecodeCache
 from jingu.lexer import Token, TokenType
+from jingu.runtime import getter
 
 
 class TestEnvironment(unittest.TestCase):
@@ -15,6 +25,183 @@ class TestEnvironment(unittest.TestCase):
 
         self.assertEqual(tmpl.source, source)
 
+    def _write(self, path, source, mtime=None):
+        with open(path, "w") as f:
+            f.write(source)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_get_template__mmap(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "page.html")
+            self._write(path, "<p>é {{ name }}</p>{% for x in xs %}{{ x }}{% endfor %}")
+            self._write(os.path.join(d, "empty.html"), "")
+            env = Environment(mmap_threshold=1)
+
+            with mock.patch("mmap.mmap", wraps=mmap.mmap) as mapped:
+                tmpl = env.get_template(path)
+            mapped.assert_called_once()
+            # output() is compiled on load, the mapping is closed
+            self.assertIsNone(tmpl.source)
+            self.assertIsNotNone(tmpl._code)
+            self.assertEqual(tmpl.render(name="ü", xs=[1, 2]), "<p>é ü</p>12")
+            self.assertEqual(asyncio.run(tmpl.render_async(name="ü", xs=[])), "<p>é ü</p>")
+            self.assertEqual(b"".join(tmpl.render_bytes(name="ü", xs=[])), "<p>é ü</p>".encode())
+            self.assertEqual(tmpl.referenced_names(), {"name", "xs"})
+            self.assertEqual(env.get_template(os.path.join(d, "empty.html")).render(), "")
+            self.assertIsInstance(Environment(mmap_threshold=1024).get_template(path).source, str)
+
+    def test_get_template__mmap_file_truncated(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "page.html")
+            self._write(path, "<p>{{ name }}</p>" * 2000)
+            tmpl = Environment(mmap_threshold=1).get_template(path)
+
+            with open(path, "w"):
+                pass
+            self.assertEqual(tmpl.render(name="a"), "<p>a</p>" * 2000)
+            # the other variants would have to map the file again
+            with self.assertRaisesRegex(RuntimeError, "changed since it was loaded"):
+                tmpl.referenced_names()
+            with self.assertRaisesRegex(RuntimeError, "changed since it was loaded"):
+                asyncio.run(tmpl.render_async(name="a"))
+            with self.assertRaisesRegex(RuntimeError, "changed since it was loaded"):
+                tmpl.render_bytes(name="a")
+
+    def test_get_template__mmap_bytecode_cache_hit(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "page.html")
+            self._write(path, "<p>{{ name }}</p>")
+            cache = FileSystemBytecodeCache(os.path.join(d, "cache"))
+            Environment(mmap_threshold=1, bytecode_cache=cache).get_template(path)
+
+            with mock.patch.object(Template, "tokenize") as tokenize:
+                tmpl = Environment(mmap_threshold=1, bytecode_cache=cache).get_template(path)
+                self.assertEqual(tmpl.render(name="a"), "<p>a</p>")
+            tokenize.assert_not_called()
+            self.assertIsNone(tmpl.source)
+
+    def test_get_template__mmap_newlines(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "page.html")
+            with open(path, "wb") as f:
+                f.write(b"<ul>\r\n{% for x in xs %}\r\n<li>{{ x }}</li>\r\n{% endfor %}\r\n</ul>\r<p></p>\r\n")
+            expected = "<ul>\n<li>1</li>\n<li>2</li>\n</ul>\n<p></p>\n"
+
+            for threshold in (None, 1, 1 << 20):
+                with self.subTest(mmap_threshold=threshold):
+                    env = Environment(trim_blocks=True, mmap_threshold=threshold)
+                    self.assertEqual(env.get_template(path).render(xs=[1, 2]), expected)
+
+    def test_get_template__cache_hit(self):
+        env = Environment()
+        testfile = 'tests/data/test_template.html'
+        tmpl = env.get_template(testfile)
+
+        self.assertIs(env.get_template(testfile), tmpl)
+        info = env.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_get_template__lru_eviction(self):
+        env = Environment(cache_size=2)
+        with tempfile.TemporaryDirectory() as d:
+            paths = [os.path.join(d, f"t{i}.html") for i in range(3)]
+            for p in paths:
+                self._write(p, p)
+
+            first = env.get_template(paths[0])
+            env.get_template(paths[1])
+            env.get_template(paths[0])
+            env.get_template(paths[2])
+
+            self.assertIs(env.get_template(paths[0]), first)
+            info = env.cache_info()
+            self.assertEqual(info.evictions, 1)
+            self.assertEqual(info.currsize, 2)
+
+            env.get_template(paths[1])
+            self.assertEqual(env.cache_info().misses, 4)
+
+    def test_get_template__auto_reload(self):
+        env = Environment(check_interval=0)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "t.html")
+            self._write(path, "Hello {{ name }}!", mtime=1000000000)
+            self.assertEqual(env.get_template(path).render(name="John"), "Hello John!")
+
+            self._write(path, "Bye {{ name }}!", mtime=1000000001)
+            self.assertEqual(env.get_template(path).render(name="John"), "Bye John!")
+
+    def test_get_template__check_interval(self):
+        env = Environment(check_interval=3600)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "t.html")
+            self._write(path, "Hello {{ name }}!", mtime=1000000000)
+            tmpl = env.get_template(path)
+
+            self._write(path, "Bye {{ name }}!", mtime=1000000001)
+            self.assertIs(env.get_template(path), tmpl)
+
+    def test_observer(self):
+        env = Environment()
+        events = []
+        env.add_observer(events.append)
+        testfile = 'tests/data/test_template.html'
+
+        tmpl = env.get_template(testfile)
+        env.get_template(testfile)
+        output = tmpl.render(title='Title', body='Body')
+        tmpl.render(title='Title', body='Body')
+
+        self.assertEqual([(e.event, e.cache_hit) for e in events],
+                         [("get_template", False), ("get_template", True), ("render", True), ("render", True)])
+        self.assertTrue(all(e.name == testfile for e in events))
+        self.assertTrue({"load", "tokenize", "parse", "codegen", "compile"} <= set(events[0].phases))
+        self.assertNotIn("load", events[1].phases)
+        self.assertEqual(events[2].output_size, len(output))
+        self.assertIn("render", events[2].phases)
+
+        env.remove_observer(events.append)
+        tmpl.render(title='Title', body='Body')
+        self.assertEqual(len(events), 4)
+
+    def test_observer__every_render_method(self):
+        env = Environment()
+        events = []
+        env.add_observer(events.append)
+        tmpl = env.get_template('tests/data/test_template.html')
+        context = {"title": "Title", "body": "Body"}
+        output = tmpl.render(context)
+        del events[:]
+
+        self.assertEqual(''.join(tmpl.generate(context)), output)
+        self.assertEqual(''.join(tmpl.stream(context).enable_buffering(16)), output)
+        tmpl.render_to(io.StringIO(), context)
+        self.assertEqual(asyncio.run(tmpl.render_async(context)), output)
+        self.assertEqual(b''.join(tmpl.render_bytes(context)), output.encode())
+        self.assertEqual(list(tmpl.render_many([context, context])), [output, output])
+
+        self.assertEqual([e.event for e in events], ["render"] * 7)
+        self.assertEqual([e.output_size for e in events], [len(output)] * 7)
+        self.assertTrue(all("render" in e.phases for e in events))
+        # the async and bytes variants were compiled for these renders
+        self.assertEqual([e.cache_hit for e in events], [True, True, True, False, False, True, True])
+        self.assertIn("compile", events[3].phases)
+        self.assertIn("compile", events[4].phases)
+
+    def test_observer__not_registered(self):
+        env = Environment()
+        tmpl = env.get_template('tests/data/test_template.html')
+        with mock.patch.object(Template, "_render_observed") as observed:
+            tmpl.render(title='Title', body='Body')
+        observed.assert_not_called()
+
+    def test_get_template__cache_disabled(self):
+        env = Environment(cache_size=0)
+        testfile = 'tests/data/test_template.html'
+        self.assertIsNot(env.get_template(testfile), env.get_template(testfile))
+        self.assertEqual(env.cache_info().currsize, 0)
+
 
 class TestTemplate(unittest.TestCase):
     def test_render(self):
@@ -118,6 +305,374 @@ class TestTemplate(unittest.TestCase):
                 expected = c[1]
                 self.assertEqual(actual, expected)
 
+    def test_render__non_string_variable(self):
+        tmpl = Template("{{ n }} / {{ items[0] }}")
+        self.assertEqual(tmpl.render(n=1, items=[2.5]), "1 / 2.5")
+
+    def test_generate(self):
+        tmpl = Template("<p>{{ name }}</p>")
+        gen = tmpl.generate(name='John Doe')
+        self.assertEqual(next(gen), "<p>")
+        self.assertEqual(list(gen), ["John Doe", "</p>"])
+
+    def test_stream(self):
+        tmpl = Template("<p>{{ name }}</p>")
+        self.assertEqual(list(tmpl.stream(name='John Doe')), ["<p>", "John Doe", "</p>"])
+
+    def test_stream__buffering(self):
+        tmpl = Template("<p>{{ a }}{{ b }}{{ c }}</p>")
+        stream = tmpl.stream(a='aaaa', b='bbbb', c='cccc').enable_buffering(size=8)
+        self.assertTrue(stream.buffered)
+        self.assertEqual(list(stream), ["<p>aaaabbbb", "cccc</p>"])
+
+        with self.assertRaises(ValueError):
+            tmpl.stream().enable_buffering(size=0)
+
+    def test_render_to__text(self):
+        tmpl = Template("<p>{{ a }}{{ b }}</p>")
+        fp = io.StringIO()
+        tmpl.render_to(fp, a='aaaa', b='bbbb')
+        self.assertEqual(fp.getvalue(), "<p>aaaabbbb</p>")
+
+    def test_render_to__binary(self):
+        tmpl = Template("<p>{{ name }}</p>")
+        fp = io.BytesIO()
+        tmpl.render_to(fp, name='Jöhn')
+        self.assertEqual(fp.getvalue(), "<p>Jöhn</p>".encode("utf-8"))
+
+    def test_render_to__mode_of_other_writers(self):
+        tmpl = Template("hi {{ n }}")
+        for mode, expected in [("w+", "hi é"), ("w+b", "hi é".encode("utf-8"))]:
+            with self.subTest(mode=mode), tempfile.SpooledTemporaryFile(mode=mode) as fp:
+                tmpl.render_to(fp, n="é")
+                fp.seek(0)
+                self.assertEqual(fp.read(), expected)
+
+        class Writer(object):
+            def __init__(self):
+                self.written = []
+
+            def write(self, data):
+                self.written.append(data)
+
+        writer = Writer()
+        tmpl.render_to(writer, n=1)
+        self.assertEqual(writer.written, ["hi 1"])
+
+    def test_render_to__batching(self):
+        tmpl = Template("{{ a }}{{ a }}{{ a }}{{ a }}{{ a }}")
+        fp = mock.Mock()
+        tmpl.stream(a='xxxx').dump(fp, buffer_size=8)
+        self.assertEqual([c.args[0] for c in fp.write.call_args_list], ["xxxxxxxx", "xxxxxxxx", "xxxx"])
+
+    def test_render_bytes(self):
+        tmpl = Template("<p>{{ name }}</p>{% for x in xs %}{{ x }}é{% endfor %}")
+        # values and the short text around them are encoded together
+        self.assertEqual(tmpl.render_bytes(name="Jöhn", xs=[1]), ["<p>Jöhn</p>".encode("utf-8"), "1é".encode("utf-8")])
+        self.assertEqual(list(tmpl.generate_bytes(name="a", xs=[])), [b"<p>a</p>"])
+        output = b"".join(tmpl.render_bytes(name="a", xs=[2, 3]))
+        self.assertEqual(output, tmpl.render(name="a", xs=[2, 3]).encode("utf-8"))
+
+    def test_render_bytes__static_text_encoded_at_compile_time(self):
+        text = "<p>é" * 100
+        tmpl = Template(text + "{{ name }}</p>")
+        tmpl.encoding = "latin-1"
+        source = tmpl.compile_source(encoding=tmpl.encoding)
+        self.assertIn("yield b'<p>\\xe9<p>", source)
+        self.assertIn("yield ''.join((str(context['name']), '</p>')).encode('latin-1')", source)
+        self.assertEqual(tmpl.render_bytes(name="ü"), [text.encode("latin-1"), b"\xfc</p>"])
+
+    def test_render_bytes__autoescape_and_cache(self):
+        env = Environment()
+        tmpl = Template("{{ a }}{% cache 'k' %}{{ b.c }}{% endcache %}", environment=env, autoescape=True)
+        self.assertEqual(tmpl.render(a="<", b={"c": "1"}), "&lt;1")
+        self.assertEqual(tmpl.render_bytes(a="<", b={"c": "2"}), [b"&lt;", b"1"])
+
+    def test_render__context_dict(self):
+        ctx = {'name': 'John Doe'}
+        tmpl = Template("Hello {{ name }}!")
+        self.assertEqual(tmpl.render(ctx), "Hello John Doe!")
+        self.assertEqual(tmpl.render(ctx, name='Jane Doe'), "Hello Jane Doe!")
+        self.assertEqual(ctx, {'name': 'John Doe'})
+
+    def test_render__missing_variable(self):
+        with self.assertRaises(KeyError):
+            Template("Hello {{ name }}!").render()
+
+    def test_compile_source__fast_locals(self):
+        tmpl = Template("{{ a }}{{ b }}{{ a + 1 }}{{ a.x }}")
+        source = tmpl.compile_source()
+        self.assertIn("def output(context):", source)
+        self.assertEqual(source.count("context['a']"), 1)
+        self.assertIn("l_a = context['a']", source)
+        self.assertNotIn("l_b", source)
+        self.assertEqual(Template("{{ a }}{{ a }}").render(a=1), "11")
+
+    def test_compile_source__conditional_names_not_bound(self):
+        for source in ["{% if show %}{{ x }}{% endif %}", "{% if show %}{{ x }}{{ x }}{% endif %}"]:
+            with self.subTest(source=source):
+                tmpl = Template(source)
+                self.assertEqual(tmpl.render(show=False), "")
+                self.assertNotIn("l_x", tmpl.compile_source())
+                with self.assertRaises(KeyError):
+                    tmpl.render(show=True)
+        self.assertIn("l_x = context['x']", Template("{{ x }}{% if show %}{{ x }}{% endif %}").compile_source())
+
+    def test_render__empty(self):
+        self.assertEqual(Template("").render(), "")
+
+    def test_render__compile_once(self):
+        tmpl = Template("Hello {{ name }}!")
+        with mock.patch.object(tmpl, "tokenize", wraps=tmpl.tokenize) as tokenize:
+            for _ in range(3):
+                self.assertEqual(tmpl.render(name='John Doe'), "Hello John Doe!")
+        self.assertEqual(tokenize.call_count, 1)
+
+    def test_render__repeated_render_cost(self):
+        tmpl = Template("Hello {{ name }} and {{ name2 }}!")
+
+        def best_of(n):
+            best = float("inf")
+            for _ in range(n):
+                start = time.perf_counter()
+                tmpl.render(name='John Doe', name2='Jane Doe')
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        tmpl.render(name='John Doe', name2='Jane Doe')
+        early = best_of(100)
+        best_of(9800)
+        late = best_of(100)
+
+        self.assertLess(late, early * 3)
+
+    def test_render__attribute_lookup(self):
+        @dataclass
+        class User(object):
+            name: str
+
+        class Slots(object):
+            __slots__ = ("name",)
+
+            def __init__(self, name):
+                self.name = name
+
+        Point = namedtuple("Point", ["x", "y"])
+        tmpl = Template("{{ user.name }}")
+        for user in [{"name": "a"}, User("b"), Slots("c"), UserDict(name="d"), {"name": "e"}, User("f")]:
+            with self.subTest(user=user):
+                self.assertEqual(tmpl.render(user=user), user["name"] if hasattr(user, "keys") else user.name)
+
+        self.assertEqual(Template("{{ p.x }}{{ p[1] }}{{ p['y'] }}").render(p=Point(1, 2)), "122")
+
+    def test_render__chained_lookup(self):
+        @dataclass
+        class Item(object):
+            tags: list
+
+        tmpl = Template("{{ order.items[1].tags[0]['name'] }}")
+        order = {"items": [None, Item([{"name": "sale"}])]}
+        self.assertEqual(tmpl.render(order=order), "sale")
+        self.assertEqual(tmpl.compile_source().count("getter("), 5)
+
+    def test_render__lookup_dict_prefers_items(self):
+        class Dict(dict):
+            pass
+
+        tmpl = Template("{{ d.items }}")
+        self.assertEqual(tmpl.render(d={"items": 1}), "1")
+        self.assertEqual(tmpl.render(d=Dict(items=2)), "2")
+
+    def test_getter__cached_per_type(self):
+        calls = []
+
+        class Record(UserDict):
+            def __getattr__(self, name):
+                calls.append(name)
+                raise AttributeError(name)
+
+        get = getter("name", attribute=True)
+        self.assertEqual([get(Record(name=i)) for i in range(3)], [0, 1, 2])
+        self.assertEqual(calls, ["name"])
+
+    def test_getter__written_lookup_type(self):
+        @dataclass
+        class User(object):
+            name: str
+
+        get = getter("name", attribute=True)
+        self.assertEqual(get({"name": "a"}), "a")
+        self.assertIsNone(get.type)
+        self.assertEqual(get(UserDict(name="b")), "b")
+        self.assertIsNone(get.type)
+        self.assertEqual(get(User("c")), "c")
+        self.assertIs(get.type, User)
+
+        get = getter("name")
+        self.assertEqual(get(UserDict(name="b")), "b")
+        self.assertIs(get.type, UserDict)
+
+    def test_render__lookup_inline_for_known_type(self):
+        @dataclass
+        class User(object):
+            name: str
+
+        class Other(object):
+            name = "other"
+
+        tmpl = Template("{{ user.name }}{{ row['id'] }}{{ d.class }}")
+        render = lambda user: tmpl.render(user=user, row=UserDict(id=1), d={"class": 2})
+        self.assertEqual(render(User("a")), "a12")
+        namespace = tmpl.render_func.__globals__
+        get = namespace["get_0"]
+        with mock.patch.dict(namespace, get_0=mock.Mock(wraps=get, type=get.type)):
+            self.assertEqual(render(User("b")), "b12")
+            namespace["get_0"].assert_not_called()
+        self.assertEqual([render(u) for u in [Other(), User("c"), {"name": "d"}]], ["other12", "c12", "d12"])
+
+    def test_render__lookup_missing(self):
+        @dataclass
+        class User(object):
+            name: str
+
+        tmpl = Template("{{ user.email }}")
+        with self.assertRaises(KeyError):
+            tmpl.render(user={"name": "a"})
+        with self.assertRaises(AttributeError):
+            tmpl.render(user=User("a"))
+
+    def test_render__if_with_variable(self):
+        tmpl = Template("{% if user.admin %}<b>{{ user.name }}</b>{% endif %}")
+        self.assertEqual(tmpl.render(user={'admin': True, 'name': 'John'}), "<b>John</b>")
+        self.assertEqual(tmpl.render(user={'admin': False, 'name': 'John'}), "")
+
+    def test_render__for(self):
+        tmpl = Template("<ul>{% for item in items %}<li>{{ item }}</li>{% endfor %}</ul>")
+        self.assertEqual(tmpl.render(items=['a', 'b']), "<ul><li>a</li><li>b</li></ul>")
+        self.assertEqual(tmpl.render(items=[]), "<ul></ul>")
+
+    def test_render__for_nested(self):
+        tmpl = Template("{% for row in rows %}[{% for cell in row.cells %}{{ cell }}{{ sep }}{% endfor %}]{% endfor %}")
+        actual = tmpl.render(rows=[{'cells': [1, 2]}, {'cells': [3]}], sep=',')
+        self.assertEqual(actual, "[1,2,][3,]")
+
+    def test_render__for_loop_helper(self):
+        tmpl = Template(
+            "{% for x in items %}{{ loop.index }}:{{ loop.index0 }}:{{ x }}"
+            "{% if loop.first %}F{% endif %}{% if loop.last %}L{% endif %} {% endfor %}"
+        )
+        self.assertEqual(tmpl.render(items=iter('abc')), "1:0:aF 2:1:b 3:2:cL ")
+
+    def test_render__for_loop_helper_nested(self):
+        tmpl = Template("{% for x in xs %}{% for y in ys %}{{ loop.index }}{% endfor %}{{ loop.index * 10 }} {% endfor %}")
+        self.assertEqual(tmpl.render(xs=[1, 2], ys=[1, 2, 3]), "12310 12320 ")
+
+    def test_render__for_body_names_not_bound(self):
+        tmpl = Template("{% for i in items %}{{ extra }}{% endfor %}")
+        self.assertEqual(tmpl.render(items=[]), "")
+        self.assertEqual(tmpl.render(items=[1, 2], extra="x"), "xx")
+        self.assertIn("l_extra", Template("{{ extra }}{% for i in items %}{{ extra }}{% endfor %}").compile_source())
+
+    def test_render__for_target_named_loop(self):
+        tmpl = Template(
+            "{% for loop in items %}{{ loop.x }}"
+            "{% for i in loop.ys %}{{ loop.index }}{{ i }}{% endfor %}{% endfor %}"
+        )
+        self.assertEqual(tmpl.render(items=[{"x": "a", "ys": ["b", "c"]}]), "a1b2c")
+
+    def test_render__for_target_does_not_leak(self):
+        tmpl = Template("{{ x }}{% for x in xs %}{{ x }}{% endfor %}{{ x }}")
+        self.assertEqual(tmpl.render(x='-', xs=[1, 2]), "-12-")
+
+    def test_generate__for_is_lazy(self):
+        consumed = []
+
+        def items():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+
+        tmpl = Template("{% for i in items %}{{ i }}{% if loop.last %}.{% endif %}{% endfor %}")
+        gen = tmpl.generate(items=items())
+        self.assertEqual(next(gen), "0")
+        self.assertEqual(consumed, [0, 1])
+        self.assertTrue(''.join(gen).endswith("999."))
+
+    def test_render_many(self):
+        tmpl = Template("Hello {{ name }}!")
+        contexts = ({'name': str(i)} for i in range(5))
+        with mock.patch.object(tmpl, "tokenize", wraps=tmpl.tokenize) as tokenize:
+            results = tmpl.render_many(contexts)
+            self.assertEqual(next(results), "Hello 0!")
+            self.assertEqual(list(results), ["Hello 1!", "Hello 2!", "Hello 3!", "Hello 4!"])
+        self.assertEqual(tokenize.call_count, 1)
+
+    def test_render_many__workers(self):
+        tmpl = Template("{% for x in xs %}{{ x }}{% endfor %}-{{ n }}")
+        contexts = [{'xs': range(i % 3), 'n': i} for i in range(300)]
+        expected = [tmpl.render(c) for c in contexts]
+        self.assertEqual(list(tmpl.render_many(contexts, workers=2, chunksize=7)), expected)
+
+    def test_render_many__workers_bounded(self):
+        consumed = []
+
+        def contexts():
+            for i in range(100000):
+                consumed.append(i)
+                yield {'n': i}
+
+        results = Template("{{ n }}").render_many(contexts(), workers=2, chunksize=10)
+        self.assertEqual([next(results) for _ in range(3)], ["0", "1", "2"])
+        self.assertLessEqual(len(consumed), 50)
+        results.close()
+
+    def test_render__whitespace_control(self):
+        env = Environment(trim_blocks=True, lstrip_blocks=True)
+        tmpl = Template("<ul>\n  {% for x in xs %}\n  <li>{{ x }}</li>\n  {% endfor %}\n</ul>", environment=env)
+        self.assertEqual(tmpl.render(xs=[1, 2]), "<ul>\n  <li>1</li>\n  <li>2</li>\n</ul>")
+        self.assertEqual(Template("a {{- x -}} b").render(x=1), "a1b")
+
+    def test_render__minify(self):
+        tmpl = Template(
+            "<div>\n    <p>  {{ text }}  </p>\n\n</div>\n<pre>\n  keep  {{ text }}\n</pre>  <i> x </i>",
+            minify=True,
+        )
+        self.assertEqual(
+            tmpl.render(text="a  b"), "<div>\n<p> a  b </p>\n</div>\n<pre>\n  keep  a  b\n</pre> <i> x </i>"
+        )
+        self.assertIn("'<div>\\n<p> '", tmpl.compile_source())
+
+    def test_render__minify_keeps_script_and_style(self):
+        source = "<style>\n  a  { b: c }\n</style>\n\n<script>\n  var s = 'a  b';\n</script>\n\n<p>  x  </p>"
+        self.assertEqual(
+            Template(source, minify=True).render(),
+            "<style>\n  a  { b: c }\n</style>\n<script>\n  var s = 'a  b';\n</script>\n<p> x </p>",
+        )
+
+    def test_render__non_breaking_space_kept(self):
+        self.assertEqual(Template("<td>10\u00a0\u00a0km</td>", minify=True).render(), "<td>10\u00a0\u00a0km</td>")
+        self.assertEqual(Template("a\u00a0{{- x -}}\u00a0b").render(x=1), "a\u00a01\u00a0b")
+        self.assertEqual(Template("a\u00a0 {{- x -}} \u00a0b".encode()).render(x=1), "a\u00a01\u00a0b")
+
+    def test_options(self):
+        env = Environment(minify=True)
+        self.assertTrue(Template("", environment=env).minify)
+        self.assertFalse(Template("", environment=env, minify=False).minify)
+        with self.assertRaises(TypeError):
+            Template("", unknown=True)
+
+    def test_parse__block_errors(self):
+        for s in [
+            "{% for x in items %}{{ x }}",
+            "{% for x of items %}{% endfor %}",
+            "{% if x %}",
+            "{% unknown %}",
+            "{% for x in items %}{{ loop.length }}{% endfor %}",
+        ]:
+            with self.subTest(s=s):
+                with self.assertRaises(ParseError):
+                    Template(s).render(items=[], x=1)
+
     def test_tokenize__variable(self):
         tmpl = Template("")
         self.assertEqual(tmpl.tokenize("test"), [Token(TokenType.DATA, "test")])
@@ -411,3 +966,74 @@ John Doe!
         self.assertEqual(actual[2].left.op, "+")
         self.assertIsInstance(actual[2].left.left, ConstNode)
         self.assertIsInstance(actual[2].left.right, ConstNode)
+
+
+class TestTemplateAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_render_async__conditional_names(self):
+        tmpl = Template("{% if show %}{{ a }}{% endif %}{% for x in xs %}{{ a }}{{ b }}{% endfor %}")
+        self.assertEqual(await tmpl.render_async(show=False, xs=[]), "")
+
+        awaited = []
+
+        class Value(object):
+            def __init__(self, value):
+                self.value = value
+
+            def __await__(self):
+                awaited.append(self.value)
+                return self.value
+                yield
+        self.assertEqual(await tmpl.render_async(show=False, xs=[], a=Value("a"), b=Value("b")), "")
+        self.assertEqual(awaited, [])
+        self.assertEqual(await tmpl.render_async(show=True, xs=[1, 2], a=Value("a"), b=Value("b")), "aabab")
+        self.assertEqual(awaited, ["a", "b"])
+
+    async def test_render_async(self):
+        tmpl = Template("Hello {{ name }}!")
+        self.assertEqual(await tmpl.render_async(name='John Doe'), "Hello John Doe!")
+
+    async def test_render_async__awaitable(self):
+        async def get_name():
+            await asyncio.sleep(0)
+            return "John Doe"
+
+        tmpl = Template("Hello {{ name }} and {{ name }} ({{ n + 1 }}){% if flag %}!{% endif %}")
+        actual = await tmpl.render_async(name=get_name(), n=asyncio.sleep(0, result=1), flag=True)
+        self.assertEqual(actual, "Hello John Doe and John Doe (2)!")
+
+    async def test_render_async__for(self):
+        async def items():
+            for i in range(3):
+                await asyncio.sleep(0)
+                yield i
+
+        tmpl = Template("{% for i in items %}{{ loop.index }}={{ i }}{% if loop.last %}.{% endif %} {% endfor %}")
+        self.assertEqual(await tmpl.render_async(items=items()), "1=0 2=1 3=2. ")
+        self.assertEqual(await tmpl.render_async(items=[5]), "1=5. ")
+
+        tmpl = Template("{% for i in items %}{{ i }}{% endfor %}")
+        self.assertEqual(await tmpl.render_async(items=items()), "012")
+
+    async def test_generate_async(self):
+        tmpl = Template("<p>{{ name }}</p>")
+        chunks = [c async for c in tmpl.generate_async(name='John Doe')]
+        self.assertEqual(chunks, ["<p>", "John Doe", "</p>"])
+
+    async def test_generate_async__yields_to_loop(self):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        tmpl = Template("{{ name }}" * 100)
+        tmpl.async_yield_every = 10
+        start = ticks
+        await tmpl.render_async(name="x")
+        task.cancel()
+
+        self.assertGreaterEqual(ticks - start, 9)
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from jingu.template import Environment, Template
+
+THREADS = 32
+
+
+class Item(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class NamedDict(dict):
+    # dicts prefer items, so this is never what {{ item.name }} shows
+    name = "attribute"
+
+
+def run_threads(func, n=THREADS):
+    """call func(i) from `n` threads started at the same time, return the results in order"""
+    barrier = threading.Barrier(n)
+    results = [None] * n
+    errors = []
+
+    def target(i):
+        barrier.wait()
+        try:
+            results[i] = func(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class TestThreading(unittest.TestCase):
+    def setUp(self):
+        # switch threads as often as possible to make races likely
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.directory = self._tmpdir.name
+        os.mkdir(os.path.join(self.directory, "partials"))
+        for name, source in {
+            "page.html": '<h1>{{ title }}</h1>{% include "partials/list.html" %}',
+            os.path.join("partials", "list.html"): '<ul>{% for item in items %}{% include "item.html" %}{% endfor %}</ul>',
+            os.path.join("partials", "item.html"): "<li>{{ loop.index }} {{ item.name }}</li>",
+        }.items():
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write(source)
+        self.path = os.path.join(self.directory, "page.html")
+
+    def context(self, i):
+        items = [Item(f"a{i}"), NamedDict(name=f"b{i}"), Item(f"c{i}")]
+        return {"title": f"t{i}", "items": items}
+
+    def expected(self, i):
+        return f"<h1>t{i}</h1><ul><li>1 a{i}</li><li>2 b{i}</li><li>3 c{i}</li></ul>"
+
+    def test_first_render(self):
+        # every thread compiles and renders a variant of a template nobody
+        # compiled yet, which parses the same includes at the same time
+        def render(i):
+            kind = i % 4
+            if kind == 0:
+                return tmpl.render(self.context(i))
+            if kind == 1:
+                return b"".join(tmpl.render_bytes(self.context(i))).decode("utf-8")
+            if kind == 2:
+                return asyncio.run(tmpl.render_async(self.context(i)))
+            tmpl.referenced_names()
+            tmpl.dependencies
+            return tmpl.render(self.context(i))
+
+        for _ in range(5):
+            with open(self.path) as f:
+                tmpl = Template(f.read(), name=self.path)
+            self.assertEqual(run_threads(render), [self.expected(i) for i in range(THREADS)])
+            self.assertEqual(len(tmpl.dependencies), 2)
+            self.assertEqual(tmpl.referenced_names(), {"title", "items"})
+
+    def test_shared_template(self):
+        env = Environment()
+        renders = 200
+
+        def render(i):
+            tmpl = env.get_template(self.path)
+            expected = self.expected(i)
+            context = self.context(i)
+            for _ in range(renders):
+                self.assertEqual(tmpl.render(context), expected)
+            return tmpl
+
+        self.assertEqual(len(set(run_threads(render))), 1)
+
+    def test_throughput(self):
+        tmpl = Environment().get_template(self.path)
+        context = self.context(0)
+        tmpl.render(context)
+        renders = 100
+
+        def render(i):
+            for _ in range(renders):
+                tmpl.render(context)
+
+        start = time.perf_counter()
+        render(0)
+        single = renders / (time.perf_counter() - start)
+        start = time.perf_counter()
+        run_threads(render)
+        threaded = THREADS * renders / (time.perf_counter() - start)
+        # rendering takes no lock, so threads only share the interpreter
+        self.assertGreater(threaded, single / 4)